@@ -1,8 +1,17 @@
-from .appmar2 import APPMAR2
+import sys
 
-def main():
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv:
+        # headless mode, Tk is never imported
+        from .cli import main as cli_main
+        return cli_main(argv)
+    from .appmar2 import APPMAR2
     app = APPMAR2()
     app.run()
 
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -8,68 +8,40 @@ Diego A. Casas
 Katherine Rivera
 """
 
+import base64
 import os
-from datetime import datetime
-from itertools import product
-from threading import Thread
+from io import BytesIO
 from tkinter import PhotoImage, END
 from tkinter.filedialog import askopenfilename
-from tkinter.messagebox import showinfo, showerror
+from tkinter.messagebox import showerror, showinfo
 
 import numpy as np
-import pandas as pd
 import pygubu
-import xarray as xr
 
-from .libappmar2 import (azimuth, download_grib, extractor, format_as_dms,
-                         format_filename, parse_coord, parse_fname, compute_clusters,
-                         create_report, seastates, URL_BASE, PATH)
-from .libplot import plot_dist, plot_joint, plot_rose, save_map, plot_clusters, plot_pot_month
+from .libappmar2 import (rose_data, rose_histogram, pot_month, download_gribs, extract_series, format_as_dms,
+                         parse_coord, parse_fname, compute_clusters, load_series,
+                         create_report, seastates, peaks_report, URL_BASE, PATH,
+                         APPMAR2_DIR, YEARS, MONTHS, GRID_ID, STR_MONTHS, LABELS)
+from .libcache import ResultCache
+from .libmetrics import Metrics, format_summary
+from .libtasks import TaskScheduler
 
-APPMAR2_DIR = os.path.join(os.path.expanduser('~'), 'APPMAR2')
 DATA_PATH = os.path.dirname(__file__)
-YEARS = range(1979, 2009 + 1)
-MONTHS = range(1, 12 + 1)
 NMONTHS = len(YEARS) * len(MONTHS)
-GRID_ID = {
-    'Global 30 min': 'glo_30m_ext',
-    'Arctic Ocean curvilinear': 'aoc_15m',
-    'Gulf of Mexico and NW Atlantic 10 min': 'ecg_10m',
-    'US West Coast 10 min': 'wc_10m',
-    'Pacific Islands 10 min': 'pi_10m',
-    'Alaskan 10 min': 'ak_10m',
-    'North Sea Baltic 10 min': 'nsb_10m',
-    'Mediterranean 10 min': 'med_10m',
-    'North West Indian Ocean 10 min': 'nwio_10m',
-    'Australia 10 min': 'oz_10m',
-    'Gulf of Mexico and NW Atlantic 4 min': 'ecg_4m',
-    'US West Coast 4 min': 'wc_4m',
-    'Alaskan 4 min': 'ak_4m',
-    'North Sea Baltic 4 min': 'nsb_4m',
-    'Australia 4 min': 'oz_4m'
-}
-STR_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May',
-              'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-
-VARS = {
-    'hs': ['swh'],
-    'tp': ['perpw'],
-    'dp': ['dirpw'],
-    'wind': ['u', 'v']
-}
-
+DOWNLOAD_WORKERS = 4
+EXTRACT_WORKERS = os.cpu_count()
+EXTRACT_FORMAT = 'csv'
+EXTREME_WORKERS = os.cpu_count()
+# seconds after which a distribution is left out of the best fits
+FIT_TIMEOUT = 60
 DISTRIB = {
     'Significant wave height': ['swh'],
     'Period': ['perpw'],
     'Joint probability': ['swh', 'perpw']
 }
-
-LABELS = {
-    'hs': 'Significant\nwave height\n(m)',
-    'swh': 'Significant wave height (m)',
-    'tp': 'Period (s)',
-    'perpw': 'Period (s)',
-    'wind': 'Wind speed\n(m/s)'
+EXTREME = {
+    'GEV (annual maxima)': 'gev',
+    'GPD (peaks over threshold)': 'gpd'
 }
 
 
@@ -78,6 +50,12 @@ class APPMAR2:
     def __init__(self):
         self.parameters = []
         self.data = None
+        # identity of the loaded dataset, part of the keys of the results cache
+        self.data_key = None
+        self.results = ResultCache()
+        # the download or extraction of the progress dialog, and the analyses running
+        self.progress_task = None
+        self.analyses = 0
 
         # Create a builder
         self.builder = builder = pygubu.Builder()
@@ -99,10 +77,14 @@ class APPMAR2:
         self.dlg_input_coord = None
         self.ent_coord = None
         self.btn_coord_start = None
+        self.btn_progress_cancel = None
 
         self.cb_distrib = builder.get_object('cb-distrib')
         self.cb_distrib.current(0)
 
+        self.cb_distname = builder.get_object('cb-distname')
+        self.cb_distname.current(0)
+
         self.strvar_percentile = builder.get_variable("strvar_percentile")
 
         self.lbl_map = builder.get_object('lbl-map')
@@ -116,11 +98,22 @@ class APPMAR2:
         # Connect widgets to commands
         builder.connect_callbacks(self)
 
+        # long operations run in the background, see libtasks
+        self.tasks = TaskScheduler(self.mainwindow)
+
         os.makedirs(APPMAR2_DIR, exist_ok=True)
         os.chdir(APPMAR2_DIR)
 
     def run(self):
-        self.mainwindow.mainloop()
+        try:
+            self.mainwindow.mainloop()
+        finally:
+            self.tasks.shutdown()
+
+    def memo(self, key, name, params, func):
+        """Returns the result of an analysis of the dataset identified by key, computing it
+        with func() only the first time it is asked for with these parameters."""
+        return self.results.get((key, name, params), func)
 
     def toggle_parameter(self, parameter):
         if parameter in self.parameters:
@@ -145,6 +138,8 @@ class APPMAR2:
                 'dlg-progress', self.mainwindow)
             self.strvar_current = self.builder.get_variable('strvar-current')
             self.pb_progress = self.builder.get_object('pb-progress')
+            self.btn_progress_cancel = self.builder.get_object('btn-progress-cancel')
+            self.btn_progress_cancel['command'] = self.on_cancel
             self.dlg_progress.run()
         else:
             self.dlg_progress.show()
@@ -172,66 +167,120 @@ class APPMAR2:
         self.txt_report.delete('1.0', END)
         self.txt_report.insert('1.0', text)
 
-    def download_gribs(self):
-        grid = GRID_ID[self.cb_grid.get()]
-        for year, month, param in product(YEARS, MONTHS, self.parameters):
-            str_month = STR_MONTHS[month - 1]
-            self.strvar_current.set(f'Downloading {str_month} {year}...')
-            download_grib(grid=grid, param=param, year=year, month=month)
-            self.pb_progress.step(1)
-        showinfo(title='Download finished',
-                 message=f'Download finished. All the data is in directory {APPMAR2_DIR}')
+    def start_progress(self, text, maximum, func, *args, done=None):
+        """Runs func(task, *args), a download or an extraction, in the background, with the
+        progress dialog showing the messages it reports. done(result) is called when it
+        finishes."""
+        self.show_dlg_progress()
+        self.strvar_current.set(text)
+        self.pb_progress['value'] = 0
+        self.pb_progress['maximum'] = maximum
+        self.btn_progress_cancel['state'] = 'normal'
+        self.progress_task = self.tasks.submit(
+            func, *args, long=True, on_progress=self.step_progress,
+            on_done=lambda result: self.end_progress(done, result),
+            on_error=lambda e: self.end_progress(showerror, title='Error', message=str(e)),
+            on_cancel=self.end_progress)
+
+    def step_progress(self, text):
+        self.strvar_current.set(text)
+        self.pb_progress.step(1)
+
+    def end_progress(self, func=None, *args, **kwargs):
+        self.progress_task = None
         self.dlg_progress.close()
+        if func is not None:
+            func(*args, **kwargs)
+
+    def on_cancel(self):
+        if self.progress_task is not None:
+            self.progress_task.cancel()
+            self.btn_progress_cancel['state'] = 'disabled'
+            self.strvar_current.set('Cancelling...')
+
+    def busy(self):
+        if self.progress_task is None:
+            return False
+        showinfo(title='Busy', message='Wait for the current download or extraction to finish, or cancel it.')
+        return True
+
+    def download_gribs(self, task, grid, parameters):
+        metrics = Metrics('download')
+
+        def progress(year, month, param):
+            str_month = STR_MONTHS[month - 1]
+            rate = metrics.rate('bytes') / 2**20
+            task.progress(f'Downloaded {str_month} {year} ({param})... {rate:.1f} MB/s')
+
+        download_gribs(grid, parameters, YEARS, MONTHS,
+                       workers=DOWNLOAD_WORKERS, callback=progress, metrics=metrics)
+        return metrics.finish()
 
     def show_download_progress(self):
         self.dlg_select_grid.close()
-        self.show_dlg_progress()
-        nparam = len(self.parameters)
-        self.pb_progress['value'] = 0
-        self.pb_progress['maximum'] = NMONTHS * nparam
-        Thread(target=self.download_gribs).start()
-
-    def extract_series(self):
-        lat, lon = parse_coord(self.ent_coord.get())
-        if lon < 0:
-            lon += 360
         grid = GRID_ID[self.cb_grid.get()]
-        load = extractor(grid, lat, lon)
-        variables = [v for p in self.parameters for v in VARS[p]]
-        darr = load(1979, 1, self.parameters[0])[variables[0]]
-        if darr.isnull().all():
-            raise ValueError('The given coordinates are out of the grid.')
-        lat = float(darr.latitude)
-        lon = float(darr.longitude)
-        header = True
-        fname = format_filename(lat, lon)
-        try:
-            with open(fname, 'x') as f:
-                for year, month in product(YEARS, MONTHS):
-                    str_month = STR_MONTHS[month - 1]
-                    self.strvar_current.set(
-                        f'Extracting {str_month} {year}...')
-                    dsets = [load(year, month, p) for p in self.parameters]
-                    ds = xr.merge(dsets, join='exact')
-                    df = ds.to_dataframe().set_index('time', append=True).swaplevel()
-                    df[variables][1:].to_csv(
-                        f, header=header)
-                    if header:
-                        header = False
-                    self.pb_progress.step(1)
-            showinfo(title='Output file',
-                     message=f'Time series file {fname} written in directory {APPMAR2_DIR}')
-        except FileExistsError:
-            showerror(title='File already exist',
-                      message=f'You are trying to extract time series from a point you already extracted. You can find the time series file {fname} in {APPMAR2_DIR}')
-        self.dlg_progress.close()
+        parameters = list(self.parameters)
+
+        def done(summary):
+            showinfo(title='Download finished',
+                     message=f'Download finished. All the data is in directory {APPMAR2_DIR}\n\n'
+                             + format_summary(summary))
+
+        self.start_progress('Downloading...', NMONTHS * len(parameters),
+                            self.download_gribs, grid, parameters, done=done)
+
+    def extract_series(self, task, grid, coords, parameters):
+        metrics = Metrics('extract')
+
+        def progress(year, month):
+            str_month = STR_MONTHS[month - 1]
+            rate = metrics.rate('months') * 60
+            task.progress(f'Extracted {str_month} {year}... {rate:.1f} months/min')
+
+        # points already extracted are only completed with what they are missing
+        fnames = extract_series(grid, coords, parameters, YEARS, MONTHS,
+                                callback=progress, workers=EXTRACT_WORKERS,
+                                fmt=EXTRACT_FORMAT, metrics=metrics)
+        return fnames, metrics.finish()
 
     def show_extract_progress(self):
         self.dlg_input_coord.close()
-        self.show_dlg_progress()
-        self.pb_progress['value'] = 0
-        self.pb_progress['maximum'] = NMONTHS
-        Thread(target=self.extract_series).start()
+        # several points can be given at once, separated by semicolons
+        try:
+            coords = [parse_coord(s) for s in self.ent_coord.get().split(';')]
+        except ValueError as e:
+            showerror(title='Error', message=str(e))
+            return
+        grid = GRID_ID[self.cb_grid.get()]
+
+        def done(result):
+            fnames, summary = result
+            showinfo(title='Output file',
+                     message=f'Time series file(s) {", ".join(fnames)} written in directory {APPMAR2_DIR}\n\n'
+                             + format_summary(summary))
+
+        self.start_progress('Extracting...', NMONTHS, self.extract_series,
+                            grid, coords, list(self.parameters), done=done)
+
+    def analyze(self, func, show):
+        """Computes func(memo) in the background, keeping the main window responsive, and
+        then calls show(result) unless another file was loaded meanwhile. memo(name,
+        params, func) is self.memo for the loaded dataset."""
+        key = self.data_key
+        self.analyses += 1
+        self.mainwindow.config(cursor='watch')
+
+        def end(func=None, *args):
+            self.analyses -= 1
+            if not self.analyses:
+                self.mainwindow.config(cursor='')
+            if func is not None and key == self.data_key:
+                func(*args)
+
+        self.tasks.submit(lambda task: func(lambda *args: self.memo(key, *args)),
+                          on_done=lambda result: end(show, result),
+                          on_error=lambda e: end(lambda: showerror(title='Error', message=str(e))),
+                          on_cancel=end)
 
     def on_toggle_hs(self):
         self.toggle_parameter('hs')
@@ -246,93 +295,158 @@ class APPMAR2:
         self.toggle_parameter('wind')
 
     def on_download(self):
+        if self.busy():
+            return
         self.show_dlg_select_grid()
         self.btn_grid_start['command'] = self.show_download_progress
 
     def on_extract(self):
+        if self.busy():
+            return
         self.show_dlg_select_grid()
         self.btn_grid_start['text'] = 'Continue'
         self.btn_grid_start['command'] = self.show_dlg_input_coord
 
     def on_load(self):
-        fname = askopenfilename()
+        fname = askopenfilename(
+            filetypes=[('Time series', '*.csv *.series'), ('All files', '*')])
         if fname == '':
             return
 
-        def date_parser(x): return datetime.strptime(x, '%Y-%m-%d')
-        self.data = pd.read_csv(
-            fname,
-            parse_dates=['time'],
-            date_parser=date_parser
-        )
+        self.data = load_series(fname)
+        st = os.stat(fname)
+        self.data_key = (os.path.abspath(fname), st.st_size, st.st_mtime_ns)
         try:
             lat, lon = parse_fname(fname)
             str_lat = format_as_dms(lat, 'lat')
             str_lon = format_as_dms(lon, 'lon')
             # it's an en dash, not a hyphen
             self.frm_map.config(text=f'{str_lat} – {str_lon}')
-            save_map('map.png', lon, lat)
-            photo = PhotoImage(file='map.png')
-            self.lbl_map.config(image=photo)
-            self.lbl_map.photo = photo
+            # pyplot is imported here, in the UI thread
+            from .libplot import save_map
+            key = self.data_key
+            self.tasks.submit(self.render_map, save_map, lon, lat,
+                              on_done=lambda data: self.show_map(key, data),
+                              on_error=lambda e: None)
         except:
             pass
         showinfo(title='Load file',
                  message=f'File {fname} was correctly loaded. Now you can run analyses and generate plots.')
 
+    def render_map(self, task, save_map, lon, lat):
+        """Renders the map of a site in a background task, as base64 PNG data for show_map."""
+        buf = BytesIO()
+        save_map(buf, lon, lat)
+        return base64.b64encode(buf.getvalue())
+
+    def show_map(self, key, data):
+        if key != self.data_key:
+            return
+        photo = PhotoImage(data=data)
+        self.lbl_map.config(image=photo)
+        self.lbl_map.photo = photo
+
     def on_distrib(self):
         if self.data is None:
             return
+        from .libplot import dist_curves, joint_density, plot_dist, plot_joint
         lbl = self.cb_distrib.get()
+        data = self.data
         if "Joint" in lbl:
             h1 = DISTRIB[lbl][0]
             h2 = DISTRIB[lbl][1]
-            x1 = self.data[h1].values
-            x2 = self.data[h2].values
+            x1 = data[h1].values
+            x2 = data[h2].values
             t1 = LABELS[h1]
             t2 = LABELS[h2]
-            plot_joint(x1, x2, t1, t2)
-            self.show_dlg_report(create_report(x1, t1) +
-                                 '\n' + create_report(x2, t2))
+
+            def show(result):
+                density, report = result
+                plot_joint(x1, x2, t1, t2, density=density)
+                self.show_dlg_report(report)
+
+            self.analyze(lambda memo: (memo('joint', (h1, h2), lambda: joint_density(x1, x2)),
+                                       memo('report', (h1,), lambda: create_report(x1, t1)) + '\n' +
+                                       memo('report', (h2,), lambda: create_report(x2, t2))), show)
             return
         h = DISTRIB[lbl][0]
-        x = self.data[h].values
+        x = data[h].values
         t = LABELS[h]
-        plot_dist(x, t)
-        self.show_dlg_report(create_report(x, t))
+
+        def show(result):
+            curves, report = result
+            plot_dist(x, t, curves=curves)
+            self.show_dlg_report(report)
+
+        self.analyze(lambda memo: (memo('dist', (h,), lambda: dist_curves(x)),
+                                   memo('report', (h,), lambda: create_report(x, t))), show)
 
     def on_rose(self):
+        from .libplot import plot_rose
         rosetype = self.builder.tkvariables['rosetype'].get()
-        if rosetype == 'wind':
-            u = self.data['u']
-            v = self.data['v']
-            plot_rose(
-                azimuth(u, v),
-                np.sqrt(u**2 + v**2),
-                LABELS[rosetype]
-            )
-            return
-        plot_rose(
-            self.data['dirpw'].values,
-            self.data[VARS[rosetype][0]].values,
-            LABELS[rosetype]
-        )
+        d, x = rose_data(self.data, rosetype)
+        self.analyze(lambda memo: memo('rose', (rosetype, 5, False),
+                                       lambda: rose_histogram(d, x, 5, False)),
+                     lambda table: plot_rose(d, x, LABELS[rosetype], table=table))
 
     def on_seastates(self):
+        from .libplot import plot_clusters
         hs = self.data["swh"].values
         tp = self.data["perpw"].values
         pairs = np.column_stack((hs, tp))
-        centers, labels = compute_clusters(pairs)
-        plot_clusters(pairs, centers, labels)
-        self.show_dlg_report(seastates(centers))
+
+        def show(result):
+            centers, labels = result
+            plot_clusters(pairs, centers, labels)
+            self.show_dlg_report(seastates(centers))
+
+        self.analyze(lambda memo: memo('clusters', (), lambda: compute_clusters(pairs)), show)
+
+    def extreme_params(self):
+        model = EXTREME[self.cb_distname.get()]
+        # the threshold only matters for peaks over threshold
+        str_p = self.strvar_percentile.get() if model == 'gpd' else None
+        return model, str_p
 
     def on_ext(self):
-        pass
+        if self.data is None:
+            return
+        from .libextreme import extremes_report, fit_extremes
+        from .libplot import plot_return_levels
+        model, str_p = self.extreme_params()
+        data = self.data
+
+        def show(result):
+            plot_return_levels(result, LABELS['swh'])
+            self.show_dlg_report(extremes_report(result))
+
+        self.analyze(lambda memo: memo('extremes', (model, str_p),
+                                       lambda: fit_extremes(data, model, str_p, workers=EXTREME_WORKERS)),
+                     show)
+
+    def on_bestfit(self):
+        if self.data is None:
+            return
+        from .libextreme import extreme_sample
+        from .libstats import fit_and_test_all, fits_report
+        model, str_p = self.extreme_params()
+        distname = self.cb_distname.get()
+        data = self.data
+
+        def fits():
+            sample, _, _ = extreme_sample(data, model, str_p)
+            return fit_and_test_all(sample, workers=EXTREME_WORKERS, timeout=FIT_TIMEOUT)
+
+        self.analyze(lambda memo: memo('bestfit', (model, str_p), fits),
+                     lambda result: self.show_dlg_report(fits_report(result, distname)))
 
     def on_peaks(self):
+        from .libplot import plot_pot_month
         str_p = self.strvar_percentile.get()
-        months, npeaks, th = plot_pot_month(self.data, str_p)
-        txt = f"*Average number of events per year*\nP{str_p} of H (m) = {th}\n"
-        for m, n in zip(months, npeaks):
-            txt += f"{m}: {n}\n"
-        self.show_dlg_report(txt)
+        data = self.data
+
+        def show(pot):
+            months, npeaks, th = plot_pot_month(data, str_p, pot=pot)
+            self.show_dlg_report(peaks_report(months, npeaks, th, str_p))
+
+        self.analyze(lambda memo: memo('peaks', (str_p,), lambda: pot_month(data, str_p)), show)
@@ -0,0 +1,278 @@
+"""
+Command-line interface of APPMAR 2, for running downloads, extractions and analyses
+without a display, e.g. in batch jobs on servers.
+"""
+
+import argparse
+import os
+import sys
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
+
+from .libappmar2 import (APPMAR2_DIR, GRID_ID, LABELS, MONTHS, STR_MONTHS, VARS,
+                         compute_clusters, convert_grid, create_report, download_gribs,
+                         extract_series, format_report, load_series, parse_coord, parse_sites,
+                         peaks_report, pot_month, prebuild_indexes, rose_data,
+                         rose_histogram, rose_report, seastates)
+from .libmetrics import Metrics, format_summary, json_lines
+from .libseries import EXTENSIONS, export_csv
+
+METRICS_HELP = 'append timings, counters and throughput to FILE, one JSON object per line'
+STREAM_HELP = 'read the file in chunks, for series too long to load (quantiles within 0.5 %%)'
+
+
+def progress(args, fmt):
+    def f(year, month, *rest):
+        if not args.quiet:
+            print(fmt.format(STR_MONTHS[month - 1], year, *rest), file=sys.stderr)
+    return f
+
+
+@contextmanager
+def instrument(args, pipeline):
+    """Yields the Metrics of a pipeline run, written as JSON lines to the --metrics file if
+    given. The summary is written and, unless quiet, printed, even if the run fails."""
+    with ExitStack() as stack:
+        sinks = []
+        if args.metrics:
+            sinks.append(json_lines(stack.enter_context(open(args.metrics, 'a'))))
+        metrics = Metrics(pipeline, sinks)
+        try:
+            yield metrics
+        finally:
+            summary = metrics.finish()
+            if not args.quiet:
+                print(format_summary(summary), file=sys.stderr)
+
+
+def cmd_download(args):
+    with instrument(args, 'download') as metrics:
+        download_gribs(args.grid, args.parameters, args.years, MONTHS, workers=args.workers,
+                       callback=progress(args, 'Downloaded {} {} ({})'), metrics=metrics)
+
+
+def cmd_index(args):
+    prebuild_indexes(args.grid, args.parameters, args.years, MONTHS,
+                     callback=progress(args, 'Indexed {} {} ({})'))
+
+
+def cmd_convert(args):
+    path = convert_grid(args.grid, args.parameters, args.years, MONTHS,
+                        callback=progress(args, 'Converted {} {}'))
+    print(os.path.abspath(path))
+
+
+def cmd_extract(args):
+    coords = [parse_coord(s) for s in args.coord]
+    for fname in args.sites:
+        coords.extend(parse_sites(fname))
+    if not coords:
+        raise ValueError('No coordinates given, use --coord or --sites.')
+    with instrument(args, 'extract') as metrics:
+        fnames = extract_series(args.grid, coords, args.parameters, args.years, MONTHS,
+                                callback=progress(args, 'Extracted {} {}'),
+                                workers=args.workers, fmt=args.format, metrics=metrics)
+    for fname in fnames:
+        print(os.path.abspath(fname))
+
+
+def cmd_gridstats(args):
+    from .libgrid import grid_stats, write_grid_stats
+    stats = grid_stats(args.grid, args.parameters, args.years, MONTHS, workers=args.workers,
+                       callback=progress(args, 'Accumulated {} {}'))
+    fname = args.output or f'appmar2-{args.grid}-stats.nc'
+    attrs = {'grid': args.grid, 'parameters': ' '.join(args.parameters),
+             'years': f'{args.years[0]}-{args.years[-1]}'}
+    print(os.path.abspath(write_grid_stats(stats, fname, attrs)))
+
+
+def cmd_export(args):
+    csv_fname = args.output or os.path.splitext(args.file)[0] + '.csv'
+    print(os.path.abspath(export_csv(args.file, csv_fname)))
+
+
+def cmd_distrib(args):
+    if args.stream:
+        from .libstream import stream_summary
+        stats = stream_summary(args.file, [args.var])[args.var]
+        print(format_report(stats, LABELS[args.var]))
+        return
+    data = load_series(args.file)
+    print(create_report(data[args.var].values, LABELS[args.var]))
+
+
+def cmd_seastates(args):
+    data = load_series(args.file)
+    pairs = np.column_stack((data['swh'].values, data['perpw'].values))
+    centers, _ = compute_clusters(pairs)
+    print(seastates(centers))
+
+
+def cmd_peaks(args):
+    if args.stream:
+        from .libstream import stream_pot_month
+        months, npeaks, th = stream_pot_month(args.file, args.percentile)
+        print(peaks_report(months, npeaks, th, args.percentile))
+        return
+    data = load_series(args.file)
+    months, npeaks, th = pot_month(data, args.percentile)
+    print(peaks_report(months, npeaks, th, args.percentile))
+
+
+def cmd_rose(args):
+    data = load_series(args.file)
+    d, x = rose_data(data, args.type)
+    hists, _, lbls = rose_histogram(d, x, args.bins, args.quantiles)
+    print(rose_report(hists, lbls, LABELS[args.type]))
+
+
+def cmd_extremes(args):
+    from .libextreme import extremes_report, fit_extremes
+    data = load_series(args.file)
+    result = fit_extremes(data, args.model, args.percentile, replicates=args.replicates,
+                          workers=args.workers, seed=args.seed)
+    print(extremes_report(result))
+
+
+def cmd_climate(args):
+    from .libderived import climatology, stack_sites
+    t, data = stack_sites(args.files, [args.var])
+    names, mean, sd = climatology(data[args.var], t, args.by)
+    print(','.join(['file', 'statistic', *names]))
+    for fname, m, s in zip(args.files, mean, sd):
+        for stat, values in (('mean', m), ('sd', s)):
+            print(','.join([fname, stat, *(f'{v:.6g}' for v in values)]))
+
+
+def cmd_batch(args):
+    from .libbatch import batch_reports
+
+    def done(fname, manifest):
+        print(os.path.abspath(manifest))
+
+    batch_reports(args.directory, args.output, workers=args.workers,
+                  percentile=args.percentile, callback=done)
+
+
+def years(s):
+    first, _, last = s.partition('-')
+    return range(int(first), int(last or first) + 1)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='appmar2', description='Marine climate analysis. Run without arguments to open the main window.')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not report progress')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def grid_command(name, func, help):
+        sub = subparsers.add_parser(name, help=help)
+        sub.add_argument('grid', choices=sorted(GRID_ID.values()), metavar='GRID',
+                         help='grid id, e.g. ecg_10m')
+        sub.add_argument('parameters', nargs='+', choices=list(VARS), metavar='PARAM',
+                         help='hs, tp, dp and/or wind')
+        sub.add_argument('--years', type=years, default=years('1979-2009'),
+                         help='year or range of years, e.g. 1979-2009 (default)')
+        sub.add_argument('--dir', default=APPMAR2_DIR,
+                         help=f'data directory (default: {APPMAR2_DIR})')
+        sub.set_defaults(func=func, chdir=True)
+        return sub
+
+    sub = grid_command('download', cmd_download,
+                       'download GRIB files of a grid')
+    sub.add_argument('--workers', type=int, default=4,
+                     help='concurrent downloads (default: 4)')
+    sub.add_argument('--metrics', type=os.path.abspath, metavar='FILE', help=METRICS_HELP)
+    grid_command('index', cmd_index, 'prebuild the GRIB index cache of a grid')
+    grid_command('convert', cmd_convert,
+                 'convert a downloaded grid to a point-optimized store')
+    sub = grid_command('extract', cmd_extract,
+                       'extract time series at one or many points')
+    sub.add_argument('--coord', action='append', default=[], metavar='LAT,LON',
+                     help='point coordinates, can be repeated')
+    sub.add_argument('--sites', action='append', default=[], type=os.path.abspath,
+                     metavar='FILE', help='CSV file with lat,lon rows')
+    sub.add_argument('--workers', type=int, default=os.cpu_count(),
+                     help='decoding processes (default: number of CPUs)')
+    sub.add_argument('--format', choices=list(EXTENSIONS), default='csv',
+                     help='output format (default: csv)')
+    sub.add_argument('--metrics', type=os.path.abspath, metavar='FILE', help=METRICS_HELP)
+    sub = grid_command('gridstats', cmd_gridstats,
+                       'maps of mean, SD, max, P90/P99 Hs and mean wave power over a grid')
+    sub.add_argument('-o', '--output', type=os.path.abspath,
+                     help='NetCDF file (default: appmar2-GRID-stats.nc in the data directory)')
+    sub.add_argument('--workers', type=int, default=os.cpu_count(),
+                     help='processes, each one accumulating a share of the months and '
+                          'holding about 800 bytes per grid cell (default: number of CPUs, '
+                          'fewer if they do not fit in half the memory)')
+
+    def file_command(name, func, help):
+        sub = subparsers.add_parser(name, help=help)
+        sub.add_argument('file', help='time series file (CSV or binary series)')
+        sub.set_defaults(func=func, chdir=False)
+        return sub
+
+    sub = file_command('export', cmd_export, 'export a binary series file as CSV')
+    sub.add_argument('-o', '--output', help='CSV file (default: same name, .csv)')
+    sub = file_command('distrib', cmd_distrib, 'summary statistics of a variable')
+    sub.add_argument('--var', choices=['swh', 'perpw'], default='swh')
+    sub.add_argument('--stream', action='store_true', help=STREAM_HELP)
+    file_command('seastates', cmd_seastates, 'representative sea states')
+    sub = file_command('peaks', cmd_peaks,
+                       'average number of events per year over a percentile, by month')
+    sub.add_argument('-p', '--percentile', default='95')
+    sub.add_argument('--stream', action='store_true', help=STREAM_HELP)
+    sub = file_command('extremes', cmd_extremes,
+                       'return levels of the wave height with bootstrap confidence intervals')
+    sub.add_argument('--model', choices=['gev', 'gpd'], default='gev',
+                     help='annual maxima (gev, default) or peaks over threshold (gpd)')
+    sub.add_argument('-p', '--percentile', default='95',
+                     help='percentile of the threshold, for gpd (default: 95)')
+    sub.add_argument('--replicates', type=int, default=1000,
+                     help='bootstrap replicates (default: 1000)')
+    sub.add_argument('--workers', type=int, default=os.cpu_count(),
+                     help='fitting processes (default: number of CPUs)')
+    sub.add_argument('--seed', type=int, default=0)
+    sub = file_command('rose', cmd_rose, 'direction x magnitude frequency table')
+    sub.add_argument('--type', choices=['hs', 'tp', 'wind'], default='hs')
+    sub.add_argument('--bins', type=int, default=5)
+    sub.add_argument('--quantiles', action='store_true',
+                     help='use quantiles of the magnitude as bin edges')
+    sub = subparsers.add_parser(
+        'climate', help='monthly or seasonal means and SDs of a variable at many sites, as CSV')
+    sub.add_argument('files', nargs='+', metavar='FILE',
+                     help='time series files with the same times (CSV or binary series)')
+    sub.add_argument('--var', choices=['swh', 'perpw', 'wef', 'wspd'], default='wef',
+                     help='variable, wef (wave energy flux, W/m, default) and wspd '
+                          '(wind speed) are derived')
+    sub.add_argument('--by', choices=['month', 'season'], default='month')
+    sub.set_defaults(func=cmd_climate, chdir=False)
+    sub = subparsers.add_parser(
+        'batch', help='all the analyses of every appmar2-* series file in a directory')
+    sub.add_argument('directory')
+    sub.add_argument('-o', '--output',
+                     help='reports directory, one subdirectory per site (default: DIRECTORY/reports)')
+    sub.add_argument('--workers', type=int, default=os.cpu_count(),
+                     help='sites processed at once (default: number of CPUs)')
+    sub.add_argument('-p', '--percentile', default='95',
+                     help='percentile of the peaks over threshold analysis (default: 95)')
+    sub.set_defaults(func=cmd_batch, chdir=False)
+    return parser
+
+
+def main(argv=None):
+    """Runs a command and returns the exit status."""
+    args = build_parser().parse_args(argv)
+    try:
+        if args.chdir:
+            os.makedirs(args.dir, exist_ok=True)
+            os.chdir(args.dir)
+        args.func(args)
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        print(f'appmar2: error: {e}', file=sys.stderr)
+        return 1
+    return 0
@@ -1,25 +1,203 @@
+import csv
+import http.client
 import os
 import shutil
-import urllib.request
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import product
+from urllib.parse import urlsplit
 
 import numpy as np
-import xarray as xr
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-from kneed import KneeLocator
 
+from .libcache import INDEX_STATS, open_grib
+from .libmetrics import Metrics
+from .libseries import (EXTENSIONS, TMP_EXT, WRITERS, is_series_file, load_series_file,
+                        read_blocks, write_blocks)
+from .libspatial import grid_index
+from .libstore import append_month, open_store, remove_store, store_extractor, store_path
+
+APPMAR2_DIR = os.path.join(os.path.expanduser('~'), 'APPMAR2')
+YEARS = range(1979, 2009 + 1)
+MONTHS = range(1, 12 + 1)
+GRID_ID = {
+    'Global 30 min': 'glo_30m_ext',
+    'Arctic Ocean curvilinear': 'aoc_15m',
+    'Gulf of Mexico and NW Atlantic 10 min': 'ecg_10m',
+    'US West Coast 10 min': 'wc_10m',
+    'Pacific Islands 10 min': 'pi_10m',
+    'Alaskan 10 min': 'ak_10m',
+    'North Sea Baltic 10 min': 'nsb_10m',
+    'Mediterranean 10 min': 'med_10m',
+    'North West Indian Ocean 10 min': 'nwio_10m',
+    'Australia 10 min': 'oz_10m',
+    'Gulf of Mexico and NW Atlantic 4 min': 'ecg_4m',
+    'US West Coast 4 min': 'wc_4m',
+    'Alaskan 4 min': 'ak_4m',
+    'North Sea Baltic 4 min': 'nsb_4m',
+    'Australia 4 min': 'oz_4m'
+}
+STR_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May',
+              'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+LABELS = {
+    'hs': 'Significant\nwave height\n(m)',
+    'swh': 'Significant wave height (m)',
+    'tp': 'Period (s)',
+    'perpw': 'Period (s)',
+    'wind': 'Wind speed\n(m/s)'
+}
+SERIES_DTYPES = {'swh': 'float32', 'perpw': 'float32', 'dirpw': 'float32',
+                 'u': 'float32', 'v': 'float32'}
+NDIRS = 16
+RANGE = (-11.25, 371.25)
+# records binned at a time by rose_histogram
+BLOCK_SIZE = 1 << 16
 URL_BASE = 'https://polar.ncep.noaa.gov/waves/hindcasts/'
 PATH = 'nopp-phase2/{year}{month:02}/gribs/multi_reanal.{grid}.{param}.{year}{month:02}.grb2'
+VARS = {
+    'hs': ['swh'],
+    'tp': ['perpw'],
+    'dp': ['dirpw'],
+    'wind': ['u', 'v']
+}
+CHUNK_SIZE = 1 << 16
+
+
+def connect(url_base=URL_BASE):
+    """Returns a (not yet opened) persistent HTTP connection to the server of url_base."""
+    parts = urlsplit(url_base)
+    if parts.scheme == 'https':
+        return http.client.HTTPSConnection(parts.netloc, timeout=60)
+    return http.client.HTTPConnection(parts.netloc, timeout=60)
+
+
+def _get(conn, url, headers):
+    try:
+        conn.request('GET', url, headers=headers)
+        return conn.getresponse()
+    except (http.client.RemoteDisconnected, ConnectionError):
+        # the server dropped an idle keep-alive connection, open a new one
+        conn.close()
+        conn.request('GET', url, headers=headers)
+        return conn.getresponse()
+
 
+def download_grib(conn=None, url_base=URL_BASE, **metadata):
+    """Downloads a WAVEWATCH III® 30-year Hindcast Phase 2 GRIB file with the given metadata.
 
-def download_grib(**metadata):
-    """Downloads a WAVEWATCH III® 30-year Hindcast Phase 2 GRIB file with the given metadata."""
+    Data is written to a '.part' file which is renamed once the transfer is complete, so
+    existing files are skipped without touching the network and partial files are resumed
+    with an HTTP Range request. A transfer cut short of the size the server announced
+    raises OSError and keeps the '.part' file. Returns the number of bytes transferred.
+    """
     path = PATH.format(**metadata)
-    with urllib.request.urlopen(URL_BASE + path) as res:
-        if not os.path.exists(path) or os.path.getsize(path) != res.length:
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            with open(path, 'wb') as file:
-                shutil.copyfileobj(res, file)
+    if os.path.exists(path):
+        return 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = path + '.part'
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if conn is None:
+        conn = connect(url_base)
+    url = urlsplit(url_base).path + path
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    res = _get(conn, url, headers)
+    if res.status == 416:  # the partial file already holds the whole resource
+        res.read()
+        os.replace(part, path)
+        return 0
+    if res.status not in (200, 206):
+        res.read()
+        raise OSError(f'HTTP {res.status} {res.reason}: {url_base + path}')
+    size = expected_size(res, offset)
+    mode = 'ab' if res.status == 206 else 'wb'
+    with open(part, mode) as file:
+        shutil.copyfileobj(res, file, CHUNK_SIZE)
+        total = file.tell()
+    if size is not None and total != size:
+        # the '.part' file is kept, to be resumed by the next run
+        conn.close()
+        raise OSError(f'Incomplete transfer, {total} of {size} bytes: {url_base + path}')
+    os.replace(part, path)
+    return total - (offset if res.status == 206 else 0)
+
+
+def expected_size(res, offset):
+    """Returns the size the file will have once a 200 or 206 response to a request from
+    offset is written, or None if the server does not tell. Raises OSError if a 206
+    response does not start at offset."""
+    if res.status == 200:
+        length = res.getheader('Content-Length')
+        return int(length) if length is not None else None
+    # Content-Range: bytes start-end/total, total may be '*'
+    span, _, total = (res.getheader('Content-Range') or '').partition('/')
+    start, _, end = span.replace('bytes', '').strip().partition('-')
+    if not start.isdigit() or int(start) != offset:
+        res.read()
+        raise OSError(f'Unexpected Content-Range {res.getheader("Content-Range")!r} '
+                      f'for a request from byte {offset}')
+    if total.strip().isdigit():
+        return int(total)
+    return int(end) + 1 if end.strip().isdigit() else None
+
+
+def download_gribs(grid, params, years, months, workers=4, url_base=URL_BASE, callback=None,
+                   metrics=None):
+    """Downloads the GRIB files of a grid for every year, month and parameter.
+
+    Files are fetched by a pool of workers, each one reusing its own HTTP connection.
+    callback(year, month, param) is called from the calling thread as files complete.
+    Each transfer is timed in metrics (a libmetrics.Metrics), with the bytes it got;
+    files already downloaded are only counted as skipped.
+    """
+    metrics = metrics or Metrics('download')
+    keys = list(product(years, months, params))
+    metrics.emit('start', grid=grid, files=len(keys), workers=workers)
+    local = threading.local()
+    conns = []
+    lock = threading.Lock()
+
+    def job(year, month, param):
+        if not hasattr(local, 'conn'):
+            local.conn = connect(url_base)
+            with lock:
+                conns.append(local.conn)
+        if os.path.exists(PATH.format(grid=grid, param=param, year=year, month=month)):
+            metrics.count('skipped')
+            return year, month, param
+        with metrics.timer('download', year=year, month=month, param=param) as step:
+            step['bytes'] = download_grib(local.conn, url_base, grid=grid,
+                                          param=param, year=year, month=month)
+        metrics.count('files')
+        metrics.count('bytes', step['bytes'])
+        return year, month, param
+
+    try:
+        with ThreadPoolExecutor(workers) as pool:
+            futures = [pool.submit(job, *key) for key in keys]
+            try:
+                for future in as_completed(futures):
+                    key = future.result()
+                    if callback is not None:
+                        callback(*key)
+            except BaseException:
+                # e.g. cancelled from the callback: only the transfers under way finish
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+def prebuild_indexes(grid, parameters, years=YEARS, months=MONTHS, callback=None):
+    """Builds the cached cfgrib indexes of every downloaded GRIB file of a grid, so that later
+    extractions skip the message scan. callback(year, month, param) is called after each file."""
+    for year, month, param in product(years, months, parameters):
+        path = PATH.format(grid=grid, year=year, month=month, param=param)
+        if os.path.exists(path):
+            open_grib(path).close()
+        if callback is not None:
+            callback(year, month, param)
 
 
 def parse_coord(s):
@@ -27,16 +205,76 @@ def parse_coord(s):
     return float(lat), float(lon)
 
 
+def parse_sites(fname):
+    """Reads 'lat,lon' coordinates from a CSV file, one site per row. Extra columns and rows
+    that are not coordinates (e.g. a header) are ignored."""
+    coords = []
+    with open(fname, newline='') as f:
+        for row in csv.reader(f):
+            try:
+                coords.append((float(row[0]), float(row[1])))
+            except (ValueError, IndexError):
+                pass
+    return coords
+
+
+def spatial_index(grid, path=None):
+    """Returns the spatial index of a grid (see libspatial). The first time, it is built
+    from the GRIB file at path or, if it was not downloaded, from the store."""
+    def source():
+        if path is not None and os.path.exists(path):
+            return open_grib(path)
+        store = open_store(grid)
+        if store is None:
+            raise FileNotFoundError(path)
+        # a month, for the cells under seasonal ice
+        return store.isel(valid_time=store.time.values == store.time.values[0])
+    return grid_index(grid, source)
+
+
 def extractor(grid, lat, lon):
+    load = multi_extractor(grid, [lat], [lon])
+    return lambda *args: load(*args).isel(point=0)
+
+
+def multi_extractor(grid, lats, lons):
+    """Like extractor, but each GRIB file is decoded once and the nearest grid points of all
+    the given coordinates are gathered at once, stacked along a new 'point' dimension."""
+    indexers = {}
+
     def f(year, month, param):
         path = PATH.format(grid=grid, year=year, month=month, param=param)
-        dset = xr.open_dataset(path, engine='cfgrib').sel(
-            latitude=lat, longitude=lon, method='nearest')
-        return dset
-    return f
+        if not indexers:
+            indexers.update(spatial_index(grid, path).indexers(lats, lons))
+        return open_grib(path).isel(indexers).load()
+    store = open_store(grid)
+    if store is None:
+        return f
+    return store_extractor(store, spatial_index(grid).indexers(lats, lons), VARS, f)
 
 
-def format_filename(lat, lon):
+def convert_grid(grid, parameters, years=YEARS, months=MONTHS, callback=None):
+    """Converts the downloaded GRIB files of a grid into a single chunked Zarr store, which
+    extractor and multi_extractor then use instead of the GRIB files. callback(year, month)
+    is called after each month. Returns the store path."""
+    import xarray as xr
+    path = store_path(grid)
+    tmp = path + '.tmp'
+    # the GRIB files may be removed once converted
+    spatial_index(grid, PATH.format(grid=grid, year=years[0], month=months[0], param=parameters[0]))
+    remove_store(tmp)
+    for year, month in product(years, months):
+        dsets = [open_grib(PATH.format(grid=grid, year=year, month=month, param=p))
+                 for p in parameters]
+        append_month(tmp, xr.merge(dsets, join='exact'))
+        if callback is not None:
+            callback(year, month)
+    remove_store(path)
+    os.rename(tmp, path)
+    return path
+
+
+def format_filename(lat, lon, ext='.csv'):
     if lat >= 0:
         str_lat = f'{lat}N'
     else:
@@ -46,7 +284,221 @@ def format_filename(lat, lon):
     else:
         str_lon = f'{lon}E'
 
-    return f'appmar2-{str_lat}-{str_lon}.csv'
+    return f'appmar2-{str_lat}-{str_lon}{ext}'
+
+
+def month_frame(ds, variables):
+    df = ds.to_dataframe().set_index('time', append=True).swaplevel()
+    return df[variables][1:]
+
+
+def render_month(load, parameters, sites, year, month):
+    """Returns the series of a month for every site, as a dict {fname: DataFrame}."""
+    import xarray as xr
+    variables = [v for p in parameters for v in VARS[p]]
+    dsets = [load(year, month, p) for p in parameters]
+    ds = xr.merge(dsets, join='exact')
+    return {fname: month_frame(ds.isel(point=i), variables) for fname, i in sites.items()}
+
+
+_load = None
+
+
+def _init_worker(grid, lats, lons):
+    global _load
+    _load = multi_extractor(grid, lats, lons)
+
+
+def timed_render(load, parameters, sites, year, month):
+    """render_month, also returning the seconds it took and the index cache lookups it
+    made, for the metrics of extract_series."""
+    hits, misses = INDEX_STATS['hits'], INDEX_STATS['misses']
+    t = time.perf_counter()
+    frames = render_month(load, parameters, sites, year, month)
+    return frames, {'seconds': time.perf_counter() - t, 'pid': os.getpid(),
+                    'index_hits': INDEX_STATS['hits'] - hits,
+                    'index_misses': INDEX_STATS['misses'] - misses}
+
+
+def _render_month(*args):
+    return timed_render(_load, *args)
+
+
+def month_key(year, month):
+    return f'{year}-{month:02}'
+
+
+def series_blocks(fname):
+    """Returns the recorded size and blocks of an extracted series (see read_blocks), or
+    None if it does not exist. Blocks of files extracted before they were recorded are
+    inferred from their content."""
+    blocks = read_blocks(fname)
+    if not os.path.exists(fname):
+        # the record of a deleted file
+        return None
+    if blocks is not None:
+        return blocks
+    df = load_series(fname)
+    variables = [c for c in df.columns if c not in ('time', 'step')]
+    months = np.unique(df['time'].values.astype('datetime64[M]'))
+    return os.path.getsize(fname), {str(m): variables for m in months}
+
+
+class SeriesUpdate:
+    """The blocks of an extracted series missing for the given months and variables, and
+    their writing. Months after the last one in the file, with the same variables, are
+    appended and recorded one by one, so an interrupted extraction resumes where it
+    stopped; other blocks are merged into a new copy that replaces the file at once."""
+
+    def __init__(self, fname, fmt, meta, variables, keys):
+        self.fname = fname
+        self.fmt = fmt
+        self.meta = meta
+        self.size, self.done = series_blocks(fname) or (None, {})
+        present = list(dict.fromkeys(v for vs in self.done.values() for v in vs))
+        self.columns = list(dict.fromkeys(present + variables))
+        self.need = {}
+        for key in keys:
+            missing = [v for v in self.columns if v not in self.done.get(key, [])]
+            if missing:
+                self.need[key] = missing
+        self.frames = []
+        self.writer = None
+        if not self.need:
+            return
+        if not self.done or (set(variables) <= set(present) and min(self.need) > max(self.done)):
+            self.writer = WRITERS[fmt](fname, meta, self.size)
+            write_blocks(fname, self.writer.size, self.done)
+
+    def add(self, key, df):
+        if key not in self.need:
+            return
+        if self.writer is None:
+            self.frames.append(df[self.need[key]])
+            return
+        self.writer.append(df[self.columns])
+        self.done[key] = self.columns
+        write_blocks(self.fname, self.writer.size, self.done)
+
+    def finish(self):
+        if not self.frames:
+            return
+        import pandas as pd
+        # leave out anything written after the last recorded block
+        WRITERS[self.fmt](self.fname, self.meta, self.size)
+        old = load_series(self.fname).set_index(['time', 'step'])
+        df = old.combine_first(pd.concat(self.frames))[self.columns]
+        tmp = self.fname + TMP_EXT
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        writer = WRITERS[self.fmt](tmp, self.meta)
+        # one month at a time, like the extraction does, so values format the same way
+        for _, month in df.groupby(level='time', sort=False):
+            writer.append(month)
+        for key, missing in self.need.items():
+            self.done[key] = [v for v in self.columns if v in self.done.get(key, []) or v in missing]
+        write_blocks(self.fname, writer.size, self.done)
+        os.replace(tmp, self.fname)
+
+
+def extract_series(grid, coords, parameters, years, months, callback=None, workers=None,
+                   fmt='csv', metrics=None):
+    """Extracts the time series of the given parameters at every (lat, lon) in coords.
+
+    The GRIB archive is read in a single pass and one file is written per distinct nearest
+    grid point, in CSV or binary series format (fmt 'csv' or 'series', see libseries).
+    Files that already exist are completed with the (year, month, variable) blocks they
+    are missing only, see SeriesUpdate. With workers > 1, months are decoded in parallel
+    by a pool of processes and written back in time order. callback(year, month) is
+    called as months complete. The stages (open, plan, decode of each month, with the
+    process that did it, write and merge) are timed in metrics (a libmetrics.Metrics).
+    Returns the list of file names, in the order of coords.
+    """
+    metrics = metrics or Metrics('extract')
+    lats = [lat for lat, _ in coords]
+    lons = [lon + 360 if lon < 0 else lon for _, lon in coords]
+    variables = [v for p in parameters for v in VARS[p]]
+    with metrics.timer('open', grid=grid, points=len(coords)):
+        path = PATH.format(grid=grid, year=years[0], month=months[0], param=parameters[0])
+        index = spatial_index(grid, path)
+        load = multi_extractor(grid, lats, lons)
+    idx, dist = index.query(lats, lons)
+    outside = np.flatnonzero(dist > index.max_distance)
+    if len(outside):
+        raise ValueError(
+            f'The given coordinates {coords[outside[0]]} are out of the grid.')
+    cells = [(float(index.latitude[k]), float(index.longitude[k])) for k in zip(*idx)]
+    fnames = [format_filename(lat, lon, EXTENSIONS[fmt]) for lat, lon in cells]
+    # nearby sites may share a grid point, write it only once
+    sites = {fname: i for i, fname in reversed(list(enumerate(fnames)))}
+    jobs = list(product(years, months))
+    keys = [month_key(year, month) for year, month in jobs]
+    updates = {}
+    with metrics.timer('plan', files=len(sites)):
+        for fname, i in sites.items():
+            meta = {'grid': grid, 'lat': cells[i][0], 'lon': cells[i][1]}
+            updates[fname] = SeriesUpdate(fname, fmt, meta, variables, keys)
+        # parameters to decode for each month, those of the blocks missing from any file
+        todo = []
+        for (year, month), key in zip(jobs, keys):
+            needed = {v for u in updates.values() for v in u.need.get(key, [])}
+            params = [p for p in VARS if any(v in needed for v in VARS[p])]
+            if params:
+                todo.append((year, month, params))
+    serial = workers is None or workers < 2 or open_store(grid) is not None
+    metrics.emit('start', grid=grid, files=len(sites), months=len(todo),
+                 skipped=len(jobs) - len(todo), workers=1 if serial else workers)
+
+    def decoded(year, month, params, frames, stats, **fields):
+        metrics.add_time('decode', stats.pop('seconds'), year=year, month=month,
+                         params=params, **stats, **fields)
+        metrics.count('months')
+        metrics.count('rows', sum(len(df) for df in frames.values()))
+        metrics.count('index_hits', stats['index_hits'])
+        metrics.count('index_misses', stats['index_misses'])
+        if callback is not None:
+            callback(year, month)
+
+    def write(year, month, frames):
+        with metrics.timer('write', year=year, month=month):
+            for fname, df in frames.items():
+                updates[fname].add(month_key(year, month), df)
+
+    # the store already reads every point at once, decoding in parallel does not pay off
+    if serial:
+        for year, month, params in todo:
+            frames, stats = timed_render(load, params, sites, year, month)
+            write(year, month, frames)
+            decoded(year, month, params, frames, stats)
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(grid, lats, lons)) as pool:
+            futures = {
+                pool.submit(_render_month, params, sites, year, month): k
+                for k, (year, month, params) in enumerate(todo)
+            }
+            done = {}
+            nwritten = 0
+            try:
+                for future in as_completed(futures):
+                    k = futures[future]
+                    done[k], stats = future.result()
+                    # months decoded ahead of the next one to write wait in memory
+                    decoded(*todo[k], done[k], stats, buffered=len(done))
+                    # flush the months that are now contiguous, in time order
+                    while nwritten in done:
+                        write(*todo[nwritten][:2], done.pop(nwritten))
+                        nwritten += 1
+            except BaseException:
+                # e.g. cancelled from the callback: the months not started are dropped
+                for future in futures:
+                    future.cancel()
+                raise
+    for fname, update in updates.items():
+        if update.frames:
+            with metrics.timer('merge', file=fname):
+                update.finish()
+    return fnames
 
 
 def azimuth(x, y):
@@ -54,6 +506,48 @@ def azimuth(x, y):
     return az + 360 * (az < 0)
 
 
+def csv_dtypes(fname):
+    """Returns the column dtypes of a CSV series written by extract_series, or None if the
+    file does not have the APPMAR 2 columns."""
+    with open(fname) as f:
+        columns = f.readline().rstrip('\n').split(',')
+    if columns[0] != 'time' or not set(columns[1:]) <= {'step', *SERIES_DTYPES}:
+        return None
+    return {c: SERIES_DTYPES.get(c, str) for c in columns[1:]}
+
+
+def parse_times(df, fast=True):
+    """Converts the 'time' and 'step' columns of a CSV series read as text, in place."""
+    import pandas as pd
+    if not fast:
+        df['time'] = pd.to_datetime(df['time'])
+        return df
+    try:
+        # reference times repeat for a whole month, to_datetime parses each once
+        df['time'] = pd.to_datetime(df['time'], format='%Y-%m-%d', cache=True)
+    except ValueError:
+        df['time'] = pd.to_datetime(df['time'], cache=True)
+    if 'step' in df:
+        # likewise, a series has only a few hundred distinct steps
+        codes, uniques = pd.factorize(df['step'])
+        df['step'] = pd.to_timedelta(uniques)[codes]
+    return df
+
+
+def load_series(fname):
+    """Loads a time series file (CSV or binary series) written by extract_series as a
+    DataFrame.
+
+    CSV files with the APPMAR 2 columns are parsed with vectorized date conversion and
+    float32 variables; other CSV files only need a 'time' column.
+    """
+    if is_series_file(fname):
+        return load_series_file(fname)
+    import pandas as pd
+    dtype = csv_dtypes(fname)
+    return parse_times(pd.read_csv(fname, dtype=dtype), dtype is not None)
+
+
 def parse_fname(fname):
     _, str_lat, str_lon = os.path.splitext(
         os.path.split(fname)[1]
@@ -82,33 +576,191 @@ def format_as_dms(dd, mode):
     return f'{abs(d):.0f}°{m:.0f}\'{s:.0f}"{sym}'
 
 
-def compute_clusters(pairs):
+def stratified_sample(x, size, bins=10, seed=0):
+    """Returns the indices of about size rows of x, drawn at random from every cell of a grid
+    of quantile bins of its columns, in proportion to the cell counts."""
+    n, ncols = x.shape
+    if n <= size:
+        return np.arange(n)
+    cells = np.zeros(n, dtype=int)
+    for j in range(ncols):
+        edges = np.quantile(x[:, j], np.linspace(0, 1, bins + 1)[1:-1])
+        cells = cells * bins + np.searchsorted(edges, x[:, j])
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(n)
+    order = order[np.argsort(cells[order], kind='stable')]
+    counts = np.bincount(cells, minlength=bins**ncols)
+    take = np.ceil(counts * size / n)
+    starts = np.cumsum(counts) - counts
+    cell = cells[order]
+    rank = np.arange(n) - starts[cell]
+    return np.sort(order[rank < take[cell]])
+
+
+def compute_clusters(pairs, kmax=10, sample=20000, minibatch=False, warm_start=True, seed=0):
+    """Clusters (Hs, Tp) pairs with k-means, k being chosen with the elbow method.
+
+    The elbow is evaluated on a stratified subsample of at most sample pairs (None for all
+    of them). With warm_start, the fit for k starts from the k - 1 centers plus the pair
+    farthest from them. The model of the chosen k is reused: it is only refined on the
+    whole data, with MiniBatchKMeans if minibatch. Results are reproducible for a seed.
+    """
+    from kneed import KneeLocator
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+    from sklearn.preprocessing import StandardScaler
     scaler = StandardScaler()
     scaled_pairs = scaler.fit_transform(pairs)
+    if sample is None:
+        subset = scaled_pairs
+    else:
+        subset = scaled_pairs[stratified_sample(scaled_pairs, sample, seed=seed)]
+    models = {}
     sse = []
-    for k in range(1, 11):
-        kmeans = KMeans(n_clusters=k)
-        kmeans.fit(scaled_pairs)
+    centers = None
+    for k in range(1, kmax + 1):
+        if warm_start and centers is not None:
+            dist = ((subset[:, None, :] - centers[None]) ** 2).sum(-1).min(1)
+            init = np.vstack([centers, subset[np.argmax(dist)]])
+            kmeans = KMeans(n_clusters=k, init=init, n_init=1, random_state=seed)
+        else:
+            kmeans = KMeans(n_clusters=k, random_state=seed)
+        kmeans.fit(subset)
+        centers = kmeans.cluster_centers_
+        models[k] = kmeans
         sse.append(kmeans.inertia_)
-    kl = KneeLocator(range(1, 11), sse, curve="convex", direction="decreasing")
-    k = kl.elbow
-    kmeans = KMeans(n_clusters=k)
-    kmeans.fit(scaled_pairs)
+    kl = KneeLocator(range(1, kmax + 1), sse, curve="convex", direction="decreasing")
+    k = kl.elbow or 1
+    kmeans = models[k]
+    if len(subset) < len(scaled_pairs):
+        init = kmeans.cluster_centers_
+        if minibatch:
+            kmeans = MiniBatchKMeans(n_clusters=k, init=init, n_init=1, random_state=seed)
+        else:
+            kmeans = KMeans(n_clusters=k, init=init, n_init=1, random_state=seed)
+        kmeans.fit(scaled_pairs)
     centers = scaler.inverse_transform(kmeans.cluster_centers_)
     labels = kmeans.labels_
     return centers, labels
 
 
-def create_report(x, t):
+def summary(x):
+    """Returns the mean, standard deviation and quartiles of x."""
     p25, p50, p75 = np.quantile(x, [0.25, 0.50, 0.75])
+    return {'mean': np.mean(x), 'sd': np.std(x), 'p25': p25, 'p50': p50, 'p75': p75}
+
+
+def create_report(x, t):
+    return format_report(summary(x), t)
+
+
+def format_report(stats, t):
     report = f"*{t}*\n" \
-        f"Mean: {np.mean(x)}\n" \
-        f"SD: {np.std(x)}\n" \
-        f"P25: {p25}\n" \
-        f"P50: {p50}\n" \
-        f"P75: {p75}\n"
+        f"Mean: {stats['mean']}\n" \
+        f"SD: {stats['sd']}\n" \
+        f"P25: {stats['p25']}\n" \
+        f"P50: {stats['p50']}\n" \
+        f"P75: {stats['p75']}\n"
     return report
 
+
+def pot_threshold(df, str_p):
+    """Returns the threshold of the peaks over threshold analyses, the P{str_p} of the
+    significant wave height."""
+    return df.swh.quantile(int(str_p) / 100)
+
+
+def pot_month(df, str_p):
+    """Returns the month names, the average number of exceedances per year of each month,
+    0 for months without exceedances, and the threshold, the P{str_p} of the significant
+    wave height."""
+    th = pot_threshold(df, str_p)
+    nyears = len(df.time.dt.year.unique())
+    counts = df.time[df.swh > th].groupby(df.time.dt.month).count()
+    npeaks = counts.reindex(range(1, 13), fill_value=0).values / nyears
+    return (STR_MONTHS, npeaks, th)
+
+
+def peaks_report(months, npeaks, th, str_p):
+    txt = f"*Average number of events per year*\nP{str_p} of H (m) = {th}\n"
+    for m, n in zip(months, npeaks):
+        txt += f"{m}: {n}\n"
+    return txt
+
+
+def uniform_bins(a, edges):
+    """Returns the indices of the values of a in the equal-width bins given by edges,
+    assigned like np.histogram does, and len(edges) - 1 for the values out of them."""
+    n = len(edges) - 1
+    lo, hi = edges[0], edges[-1]
+    out = ~((a >= lo) & (a <= hi))
+    f = a - lo
+    f *= n / (hi - lo)
+    f[out] = 0
+    idx = f.astype(np.intp)
+    np.minimum(idx, n - 1, out=idx)
+    # rounding may put values next to an edge in the neighbouring bin
+    idx[a < edges[idx]] -= 1
+    idx[(a >= edges[idx + 1]) & (idx != n - 1)] += 1
+    idx[out] = n
+    return idx
+
+
+def rose_histogram(d, x, bins=5, quantiles=False):
+    """Bins directions d (degrees) and magnitudes x for a rose plot. Returns the frequency
+    table (bins x NDIRS, relative to the number of records), the magnitude bin edges and
+    the bin labels.
+
+    Both binnings are done at once, counting combined (magnitude, direction) bin indices.
+    """
+    d = np.asarray(d)
+    x = np.asarray(x)
+    if quantiles:
+        bin_edges = np.quantile(x, np.linspace(0, 1, bins + 1))
+    else:
+        bin_edges = np.histogram_bin_edges(x, bins)
+    dir_edges = np.linspace(*RANGE, NDIRS + 2)
+    # records out of any bin are counted apart, in the last slot
+    out = bins * (NDIRS + 1)
+    counts = np.zeros(out + 1, np.intp)
+    # block by block, so temporaries stay in cache
+    for start in range(0, len(d), BLOCK_SIZE):
+        xb = x[start:start + BLOCK_SIZE]
+        if quantiles:
+            i = np.searchsorted(bin_edges[:-1], xb, side='right') - 1
+            i[i < 0] = bins
+        else:
+            i = uniform_bins(xb, bin_edges)
+        # NDIRS + 1 direction bins centered on the NDIRS directions, the last one wraps to North
+        j = uniform_bins(d[start:start + BLOCK_SIZE], dir_edges)
+        k = i * (NDIRS + 1)
+        k += j
+        k[(i == bins) | (j > NDIRS)] = out
+        counts += np.bincount(k, minlength=out + 1)
+    counts = counts[:out].reshape(bins, NDIRS + 1)
+    # the top bin is open, for the same counts with quantiles
+    bin_edges[-1] = np.inf
+    hists = counts[:, :NDIRS] / len(d)
+    hists[:, 0] += counts[:, NDIRS] / len(d)
+    lbls = [f'{x1:.1f}–{x2:.1f}' for x1, x2 in zip(bin_edges[:-1], bin_edges[1:])]
+    return hists, bin_edges, lbls
+
+
+def rose_data(df, rosetype):
+    """Returns the directions and magnitudes of a rose of type 'hs', 'tp' or 'wind'."""
+    if rosetype == 'wind':
+        u = df['u'].values
+        v = df['v'].values
+        return azimuth(u, v), np.sqrt(u**2 + v**2)
+    return df['dirpw'].values, df[VARS[rosetype][0]].values
+
+
+def rose_report(hists, lbls, t):
+    txt = f"*{t}*\n" + ", ".join(["Direction"] + lbls) + "\n"
+    for k, row in enumerate(hists.T):
+        txt += f"{k * 360 / NDIRS:g}, " + ", ".join(f"{f:.4f}" for f in row) + "\n"
+    return txt
+
+
 def seastates(centers):
     txt = "*Representative sea states*\nH (m), T (s)\n"
     for h, t in centers:
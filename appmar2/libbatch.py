@@ -0,0 +1,158 @@
+"""
+Batch reports: the analyses of the main window run over many extracted series at once.
+Figures are saved to files and the numeric results to a JSON manifest, one directory
+per site.
+"""
+
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .libappmar2 import (LABELS, NDIRS, compute_clusters, create_report, load_series,
+                         parse_fname, peaks_report, pot_month, rose_data, rose_histogram,
+                         rose_report, seastates, summary)
+from .libseries import EXTENSIONS
+
+PATTERN = 'appmar2-*'
+PERCENTILE = '95'
+# columns each rose needs, roses of variables that were not extracted are skipped
+ROSES = {'hs': ['dirpw', 'swh'], 'tp': ['dirpw', 'perpw'], 'wind': ['u', 'v']}
+MANIFEST = 'manifest.json'
+REPORT = 'report.txt'
+
+
+def find_series(directory):
+    """Returns the series files in a directory, CSV or binary, sorted by name."""
+    fnames = []
+    for ext in EXTENSIONS.values():
+        fnames.extend(glob.glob(os.path.join(directory, PATTERN + ext)))
+    return sorted(fnames)
+
+
+def site_report(fname, outdir, percentile=PERCENTILE):
+    """Runs all the analyses of a series file and saves the figures, the text report and
+    the manifest in outdir. An analysis that fails is recorded in the manifest errors
+    and does not stop the others. Returns the manifest path."""
+    from . import libplot
+    os.makedirs(outdir, exist_ok=True)
+    data = load_series(fname)
+    manifest = {'file': os.path.abspath(fname), 'records': len(data)}
+    try:
+        manifest['lat'], manifest['lon'] = parse_fname(fname)
+    except (AssertionError, ValueError):
+        pass
+    manifest.update(figures={}, errors={})
+    texts = []
+
+    def plot(name, func, *args, **kwargs):
+        func(*args, fname=os.path.join(outdir, name + '.png'), **kwargs)
+        manifest['figures'][name] = name + '.png'
+
+    def distribution(h):
+        x = data[h].values
+        manifest.setdefault('distribution', {})[h] = {
+            k: float(v) for k, v in summary(x).items()
+        }
+        texts.append(create_report(x, LABELS[h]))
+        plot(f'dist_{h}', libplot.plot_dist, x, LABELS[h])
+
+    def joint():
+        plot('joint', libplot.plot_joint, data['swh'].values, data['perpw'].values,
+             LABELS['swh'], LABELS['perpw'])
+
+    def rose(rosetype):
+        d, x = rose_data(data, rosetype)
+        table = rose_histogram(d, x)
+        hists, _, lbls = table
+        manifest.setdefault('rose', {})[rosetype] = {
+            'bins': lbls,
+            'directions': [k * 360 / NDIRS for k in range(NDIRS)],
+            'frequency': hists.tolist()
+        }
+        texts.append(rose_report(hists, lbls, LABELS[rosetype]))
+        plot(f'rose_{rosetype}', libplot.plot_rose, d, x, LABELS[rosetype], table=table)
+
+    def clusters():
+        pairs = np.column_stack((data['swh'].values, data['perpw'].values))
+        centers, labels = compute_clusters(pairs)
+        manifest['seastates'] = centers.tolist()
+        texts.append(seastates(centers))
+        plot('seastates', libplot.plot_clusters, pairs, centers, labels)
+
+    def peaks():
+        pot = pot_month(data, percentile)
+        months, npeaks, th = pot
+        manifest['peaks'] = {
+            'percentile': percentile,
+            'threshold': float(th),
+            'months': list(months),
+            'events_per_year': npeaks.tolist()
+        }
+        texts.append(peaks_report(months, npeaks, th, percentile))
+        plot('peaks', libplot.plot_pot_month, data, percentile, pot=pot)
+
+    analyses = [('dist_swh', distribution, 'swh'), ('dist_perpw', distribution, 'perpw'),
+                ('joint', joint)]
+    analyses += [(f'rose_{t}', rose, t) for t, cols in ROSES.items()
+                 if all(c in data for c in cols)]
+    analyses += [('seastates', clusters), ('peaks', peaks)]
+    for name, func, *args in analyses:
+        try:
+            func(*args)
+        except Exception as e:
+            manifest['errors'][name] = f'{type(e).__name__}: {e}'
+    with open(os.path.join(outdir, REPORT), 'w') as f:
+        f.write('\n'.join(texts))
+    path = os.path.join(outdir, MANIFEST)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return path
+
+
+def _init_worker():
+    # figures only go to files, and each process gets one core of its own
+    import matplotlib
+    matplotlib.use('Agg')
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        # optional: without it, BLAS threads may oversubscribe the cores
+        return
+    threadpool_limits(1)
+
+
+def batch_reports(directory, outdir=None, workers=None, percentile=PERCENTILE, callback=None):
+    """Writes the reports of all the series files in a directory, each one in a
+    subdirectory of outdir (directory/reports by default) named after the file. Sites are
+    spread across worker processes; callback(fname, manifest) is called as each one is
+    done. Returns the manifest paths by file name, and raises once all the sites were
+    processed if any of them failed."""
+    fnames = find_series(directory)
+    if not fnames:
+        raise ValueError(f'No series files in {directory}.')
+    outdir = outdir or os.path.join(directory, 'reports')
+    manifests = {}
+    errors = {}
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+        futures = {
+            executor.submit(site_report, fname,
+                            os.path.join(outdir, os.path.splitext(os.path.basename(fname))[0]),
+                            percentile): fname
+            for fname in fnames
+        }
+        for future in as_completed(futures):
+            fname = futures[future]
+            try:
+                manifests[fname] = future.result()
+            except Exception as e:
+                errors[fname] = e
+                continue
+            if callback is not None:
+                callback(fname, manifests[fname])
+    if errors:
+        raise RuntimeError(f'{len(errors)} of {len(fnames)} sites failed: ' +
+                           '; '.join(f'{os.path.basename(f)}: {e}' for f, e in errors.items()))
+    return {fname: manifests[fname] for fname in fnames}
@@ -0,0 +1,115 @@
+import glob
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# relative to APPMAR2_DIR, next to the nopp-phase2 tree
+INDEX_DIR = os.path.join('cache', 'index')
+MAX_INDEX_SIZE = 512 * 2**20
+# index cache lookups of open_grib in this process
+INDEX_STATS = {'hits': 0, 'misses': 0}
+
+
+def index_path(path):
+    """Returns the cfgrib index path template of a GRIB file, keyed by path, size and mtime."""
+    st = os.stat(path)
+    key = f'{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}'
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(INDEX_DIR, digest + '.{short_hash}.idx')
+
+
+def open_grib(path):
+    """Opens a GRIB file with cfgrib, reusing its message index from the cache if present."""
+    import xarray as xr
+    template = index_path(path)
+    cached = glob.glob(template.format(short_hash='*'))
+    INDEX_STATS['hits' if cached else 'misses'] += 1
+    if cached:
+        for fname in cached:
+            os.utime(fname)  # mark as recently used
+    else:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+    dset = xr.open_dataset(path, engine='cfgrib',
+                           backend_kwargs={'indexpath': template})
+    if not cached:
+        evict()
+    return dset
+
+
+def evict(max_size=MAX_INDEX_SIZE):
+    """Removes the least recently used index files until the cache fits in max_size bytes."""
+    entries = []
+    for fname in glob.glob(os.path.join(INDEX_DIR, '*.idx')):
+        try:
+            st = os.stat(fname)
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, fname))
+    total = sum(size for _, size, _ in entries)
+    for _, size, fname in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(fname)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def nbytes(obj):
+    """Rough memory footprint of an analysis result: arrays, frames and containers of them."""
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    if hasattr(obj, 'memory_usage'):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, dict):
+        return sum(nbytes(k) + nbytes(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(x) for x in obj)
+    return sys.getsizeof(obj)
+
+
+class ResultCache:
+    """Least recently used cache of analysis results, bounded in entries and bytes.
+
+    Keys are built by the caller, typically from the identity of the loaded dataset, the
+    analysis name and its parameters.
+    """
+
+    def __init__(self, maxsize=64, maxbytes=256 * 2**20):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # analyses run in background tasks, see libtasks
+        self.lock = threading.Lock()
+
+    def get(self, key, func):
+        """Returns the cached result for key, computing it with func() on a miss. func runs
+        outside the lock, so different results can be computed at once."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        result = func()
+        size = nbytes(result)
+        if size <= self.maxbytes:
+            with self.lock:
+                if key not in self.entries:
+                    self.entries[key] = (result, size)
+                    self.size += size
+                while len(self.entries) > self.maxsize or self.size > self.maxbytes:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.size -= evicted
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
@@ -0,0 +1,169 @@
+"""
+Derived parameters of the extracted series: wave energy flux, wind speed and direction,
+and monthly and seasonal climatologies.
+
+Everything is vectorized over a series or over many sites stacked as a 2D array (sites x
+time, see stack_sites) sharing the same times. Large inputs, e.g. hundreds of 31-year
+sites or the memory-mapped columns of binary series, are evaluated in chunks of the time
+axis, so that temporaries stay small: see chunked and climatology.
+"""
+
+import numpy as np
+
+from .libappmar2 import STR_MONTHS, azimuth, load_series
+
+# as in WaveEnergyFlux.ipynb, kg/m3 and m/s2
+RHO = 1000
+G = 9.81
+# elements evaluated at a time
+CHUNK_SIZE = 1 << 20
+SEASONS = ['DJF', 'MAM', 'JJA', 'SON']
+LABELS = {
+    'wef': 'Wave energy flux (W/m)',
+    'wspd': 'Wind speed (m/s)',
+    'wdir': 'Wind direction (°)'
+}
+
+
+def wave_energy_flux(t, h, rho=RHO, g=G):
+    """Wave energy flux (W/m), rho g² T H² / (64 pi), of periods t (s) and significant
+    wave heights h (m), in the dtype of the inputs."""
+    p = np.multiply(h, h)
+    p *= t
+    p *= rho * g ** 2 / (64 * np.pi)
+    return p
+
+
+def wind_speed(u, v):
+    return np.hypot(u, v)
+
+
+def wind_direction(u, v, towards=True):
+    """Azimuth (degrees clockwise from north) the wind blows towards, as in the wind
+    rose, or it blows from if towards is False."""
+    az = azimuth(u, v)
+    return az if towards else (az + 180) % 360
+
+
+# name: (columns, function)
+DERIVED = {
+    'wef': (('perpw', 'swh'), wave_energy_flux),
+    'wspd': (('u', 'v'), wind_speed),
+    'wdir': (('u', 'v'), wind_direction)
+}
+
+
+def chunked(func, *arrays, chunksize=CHUNK_SIZE):
+    """Evaluates the elementwise func(*arrays) over slices of the last axis of about
+    chunksize elements each, writing into a single output array."""
+    shape = np.broadcast(*arrays).shape
+    n = shape[-1] if shape else 1
+    step = max(1, chunksize * n // max(int(np.prod(shape)), 1))
+    out = None
+    for start in range(0, n, step):
+        part = (..., slice(start, start + step))
+        r = func(*(np.broadcast_to(a, shape)[part] for a in arrays))
+        if out is None:
+            out = np.empty(shape, r.dtype)
+        out[part] = r
+    return out
+
+
+def derived(data, name, chunksize=CHUNK_SIZE):
+    """Returns variable name of data, a DataFrame or a dict of arrays: one of its columns,
+    or a derived parameter of DERIVED computed from them."""
+    if name not in DERIVED:
+        return np.asarray(data[name])
+    columns, func = DERIVED[name]
+    return chunked(func, *(np.asarray(data[c]) for c in columns), chunksize=chunksize)
+
+
+def month_index(t):
+    """Calendar month, 0 to 11, of datetime64 times."""
+    return t.astype('datetime64[M]').astype(np.int64) % 12
+
+
+def season_index(t):
+    """Season of SEASONS, 0 (DJF) to 3 (SON), of datetime64 times."""
+    return (month_index(t) + 1) % 12 // 3
+
+
+GROUPS = {'month': (month_index, STR_MONTHS), 'season': (season_index, SEASONS)}
+
+
+class GroupMoments:
+    """Count, mean and standard deviation of values by group along the last axis, for
+    any leading (e.g. sites) axes, merged chunk by chunk with Chan's parallel update."""
+
+    def __init__(self, ngroups):
+        self.ngroups = ngroups
+        self.count = self.mean = self.m2 = 0.0
+
+    def update(self, x, groups):
+        x = np.asarray(x, np.float64)
+        order = np.argsort(groups, kind='stable')
+        keys, starts = np.unique(groups[order], return_index=True)
+        sizes = np.diff(np.append(starts, len(order)))
+        x = x[..., order]
+        valid = ~np.isnan(x)
+        n = np.zeros(x.shape[:-1] + (self.ngroups,))
+        total = np.zeros_like(n)
+        n[..., keys] = np.add.reduceat(valid, starts, axis=-1)
+        total[..., keys] = np.add.reduceat(np.where(valid, x, 0), starts, axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / n
+        # squared deviations from the mean of each group, of the values in this chunk
+        dev = np.where(valid, x - np.repeat(mean[..., keys], sizes, axis=-1), 0)
+        m2 = np.zeros_like(n)
+        m2[..., keys] = np.add.reduceat(dev * dev, starts, axis=-1)
+        self._merge(n, np.nan_to_num(mean), m2)
+
+    def merge(self, other):
+        self._merge(other.count, other.mean, other.m2)
+
+    def _merge(self, n, mean, m2):
+        total = self.count + n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(total > 0, n / total, 0)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * w
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * w
+        self.count = total
+
+    @property
+    def sd(self):
+        # population standard deviation, like np.std
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(self.m2 / self.count)
+
+
+def climatology(x, t, by='month', chunksize=CHUNK_SIZE):
+    """Returns the names of the groups, and the mean and standard deviation of x by
+    calendar month or season (by 'month' or 'season') of the datetime64 times t. x is a
+    series, or a (sites, time) array of series sharing t; the statistics have the groups
+    as their last axis, NaN for groups without values."""
+    index, names = GROUPS[by]
+    x = np.asarray(x)
+    t = np.asarray(t)
+    stats = GroupMoments(len(names))
+    step = max(1, chunksize * len(t) // max(x.size, 1))
+    for start in range(0, len(t), step):
+        stats.update(x[..., start:start + step], index(t[start:start + step]))
+    mean = np.where(stats.count > 0, stats.mean, np.nan)
+    return names, mean, stats.sd
+
+
+def stack_sites(fnames, variables):
+    """Loads series files with the same times and returns them, and a dict of (sites,
+    time) arrays of the given variables, derived ones included."""
+    t = steps = None
+    columns = {v: [] for v in variables}
+    for fname in fnames:
+        df = load_series(fname)
+        if t is None:
+            t, steps = df['time'].values, df['step'].values
+        elif not (np.array_equal(df['time'].values, t) and np.array_equal(df['step'].values, steps)):
+            raise ValueError(f'{fname} does not have the times of {fnames[0]}.')
+        for v in variables:
+            columns[v].append(derived(df, v))
+    return t, {v: np.stack(arrays) for v, arrays in columns.items()}
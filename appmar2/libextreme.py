@@ -0,0 +1,187 @@
+"""
+Extreme value analysis of the significant wave height: GEV fits to annual maxima and GPD
+fits to declustered peaks over threshold, with return levels and bootstrap confidence
+intervals.
+"""
+
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from scipy import stats
+
+from .libappmar2 import pot_threshold
+from .libstats import fit_and_test
+
+# distribution and fixed fit parameters of each model
+MODELS = {
+    'gev': (stats.genextreme, {}),
+    'gpd': (stats.genpareto, {'floc': 0})
+}
+NAMES = {'gev': 'GEV (annual maxima)', 'gpd': 'GPD (peaks over threshold)'}
+# years
+RETURN_PERIODS = np.array([2, 5, 10, 25, 50, 100])
+REPLICATES = 1000
+CONFIDENCE = 0.95
+# exceedances less than this apart belong to the same storm
+RUN_HOURS = 48
+# years with fewer records than this fraction of the most complete year are left out
+MIN_COVERAGE = 0.5
+# blocks of replicates per worker process, so that they finish at about the same time
+BLOCKS_PER_WORKER = 4
+# annual maxima or storm peaks below which a model is not fitted: 10 years for the GEV
+MIN_SAMPLE = 10
+
+
+def valid_times(df):
+    if 'step' in df:
+        return (df.time + df.step).values
+    return df.time.values
+
+
+def annual_maxima(t, x):
+    """Returns the maxima of x by calendar year of the times t, for years with enough
+    records."""
+    years = t.astype('datetime64[Y]')
+    _, inv, counts = np.unique(years, return_inverse=True, return_counts=True)
+    maxima = np.full(len(counts), -np.inf)
+    np.maximum.at(maxima, inv, x)
+    return maxima[counts >= MIN_COVERAGE * counts.max()]
+
+
+def decluster(t, x, th, run=RUN_HOURS):
+    """Returns the peaks of the storms in which x exceeds th: exceedances separated by
+    less than run hours are taken as a single storm."""
+    order = np.argsort(t, kind='stable')
+    t, x = t[order], x[order]
+    idx = np.flatnonzero(x > th)
+    if len(idx) == 0:
+        return x[idx]
+    starts = np.flatnonzero(np.diff(t[idx]) > np.timedelta64(run, 'h')) + 1
+    return np.maximum.reduceat(x[idx], np.concatenate([[0], starts]))
+
+
+def extreme_sample(df, model, str_p):
+    """Returns the sample a model is fitted to, the threshold it is relative to and the
+    mean number of sample values per year: the annual maxima for 'gev', the excesses of
+    the storm peaks over the P{str_p} threshold of plot_pot_month for 'gpd'. Raises
+    ValueError if there are fewer than MIN_SAMPLE of them."""
+    x = df.swh.values.astype(np.float64)
+    t = valid_times(df)
+    if model == 'gev':
+        sample, th, rate = annual_maxima(t, x), 0.0, 1.0
+        what = 'annual maxima'
+    else:
+        th = pot_threshold(df, str_p)
+        peaks = decluster(t, x, th)
+        nyears = len(df.time.dt.year.unique())
+        sample, rate = peaks - th, len(peaks) / nyears
+        what = f'storm peaks over P{str_p}'
+    if len(sample) < MIN_SAMPLE:
+        raise ValueError(f'{len(sample)} {what} are too few to fit a {NAMES[model]} model, '
+                         f'at least {MIN_SAMPLE} are needed.')
+    return sample, th, rate
+
+
+def _fit_replicates(name, sample, idx, kwds):
+    dist = getattr(stats, name)
+    params = np.full((len(idx), dist.numargs + 2), np.nan)
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore')
+        for k, i in enumerate(idx):
+            try:
+                params[k] = dist.fit(sample[i], **kwds)
+            except RuntimeError:
+                pass
+    return params
+
+
+def bootstrap(dist, sample, replicates=REPLICATES, workers=None, seed=0, pbfun=None, **kwds):
+    """Fits dist to replicates resamples of sample and returns their parameters, one row
+    per replicate, NaN where the fit failed. The resamples are drawn at once, so results
+    only depend on the seed; they are fitted in blocks by workers processes (default: in
+    this process). pbfun(n) is called as each block of n replicates is done."""
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, len(sample), (replicates, len(sample)))
+    if workers is None:
+        params = _fit_replicates(dist.name, sample, idx, kwds)
+        if pbfun is not None:
+            pbfun(replicates)
+        return params
+    blocks = np.array_split(idx, min(replicates, workers * BLOCKS_PER_WORKER))
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {executor.submit(_fit_replicates, dist.name, sample, block, kwds): len(block)
+                   for block in blocks}
+        for future in as_completed(futures):
+            if pbfun is not None:
+                pbfun(futures[future])
+        return np.concatenate([future.result() for future in futures])
+
+
+def fit_extremes(df, model='gev', str_p='95', replicates=REPLICATES, confidence=CONFIDENCE,
+                 workers=None, seed=0, pbfun=None):
+    """Fits an extreme value model ('gev' or 'gpd', see extreme_sample) to the significant
+    wave height and bootstraps it. Returns a dict with the sample, threshold and rate of
+    extreme_sample, the fitted parameters, their Kolmogorov-Smirnov statistic and the
+    parameters of the bootstrap replicates, to be passed to return_levels."""
+    dist, kwds = MODELS[model]
+    sample, th, rate = extreme_sample(df, model, str_p)
+    params, ks = fit_and_test(dist, sample, **kwds)
+    boot = bootstrap(dist, sample, replicates, workers, seed, pbfun, **kwds)
+    return {
+        'model': model, 'percentile': str_p, 'sample': sample, 'threshold': th,
+        'rate': rate, 'params': params, 'ks': ks, 'boot': boot, 'confidence': confidence
+    }
+
+
+def return_levels(result, periods=RETURN_PERIODS):
+    """Returns the return levels of a fit_extremes result for periods in years, and the
+    lower and upper bounds of their bootstrap confidence interval. Periods must be longer
+    than the mean time between sample values, see valid_periods."""
+    dist, _ = MODELS[result['model']]
+    periods = np.asarray(periods, dtype=np.float64)
+    invalid = periods[~valid_periods(result, periods)]
+    if len(invalid):
+        raise ValueError(f'Return periods {invalid.tolist()} must be finite and longer '
+                         f'than the {1 / result["rate"]:g} years between sample values.')
+    p = 1 - 1 / (result['rate'] * periods)
+    levels = result['threshold'] + dist.ppf(p, *result['params'])
+    boot = result['boot'][~np.isnan(result['boot']).any(1)]
+    # all the replicates at once, one row each
+    reps = result['threshold'] + dist.ppf(p, *(boot[:, [k]] for k in range(boot.shape[1])))
+    tail = (1 - result['confidence']) / 2
+    lower, upper = np.quantile(reps, [tail, 1 - tail], axis=0)
+    return levels, lower, upper
+
+
+def valid_periods(result, periods):
+    """Whether return levels are defined for each of periods: finite and exceeded less
+    than once per period by the sample rate."""
+    periods = np.asarray(periods, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        return np.isfinite(periods) & (result['rate'] * periods > 1)
+
+
+def extremes_report(result, periods=RETURN_PERIODS):
+    model = result['model']
+    c, loc, scale = result['params']
+    txt = f"*{NAMES[model]}*\n"
+    if model == 'gpd':
+        txt += f"Threshold: P{result['percentile']} of H (m) = {result['threshold']}\n" \
+            f"Storms per year: {result['rate']}\n"
+    txt += f"Sample size: {len(result['sample'])}\n"
+    # shape as in scipy.stats, c = -xi
+    txt += f"Shape (c): {c}\n"
+    if model == 'gev':
+        txt += f"Location: {loc}\n"
+    txt += f"Scale: {scale}\n"
+    txt += f"KS statistic: {result['ks']}\n"
+    nboot = len(result['boot'])
+    failed = np.isnan(result['boot']).any(1).sum()
+    txt += f"Bootstrap replicates: {nboot - failed} of {nboot}\n"
+    conf = f"{result['confidence']:.0%}"
+    txt += f"Return period (years), H (m), {conf} CI lower, {conf} CI upper\n"
+    periods = np.asarray(periods)[valid_periods(result, periods)]
+    for row in zip(periods, *return_levels(result, periods)):
+        txt += f"{row[0]:g}, " + ", ".join(f"{v:.3f}" for v in row[1:]) + "\n"
+    return txt
@@ -0,0 +1,268 @@
+"""
+Statistics maps of a whole grid, computed from its monthly GRIB files in a single pass:
+mean, standard deviation and maximum of each variable at every cell, P90 and P99 of the
+significant wave height and, with hs and tp, the mean wave energy flux. They are saved
+as a NetCDF file.
+
+Memory is bounded whatever the number of months: files are decoded STEP_CHUNK steps at a
+time into per-cell accumulators, the count, mean and sum of squared deviations (merged
+with Chan's parallel update) and, for quantiles, a histogram of HIST_WIDTH bins. Quantiles
+are interpolated within their bin, so they are less than HIST_WIDTH away from the exact
+quantile of rank floor(q * (n - 1)) (np.quantile with method='lower'); values above
+HIST_MAX share the last bin, which then extends to the maximum of the cell. Groups of
+months can be accumulated by separate processes and merged at the end.
+
+Regular grids are mapped on their (latitude, longitude) dimensions, curvilinear ones on
+their own, e.g. (y, x), with 2D latitude and longitude coordinates. Each process holds
+the histograms, 4 * HIST_MAX / HIST_WIDTH bytes per cell (800 B), and the decoded steps,
+so the number of processes is bounded to use at most MEMORY_FRACTION of the physical
+memory (see max_workers): a few hundred MB per process for the global grids.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+
+import numpy as np
+
+from .libappmar2 import PATH, VARS
+from .libcache import open_grib
+from .libderived import wave_energy_flux
+
+# steps of a GRIB file decoded at a time
+STEP_CHUNK = 24
+# histogram of the quantiles, m
+HIST_WIDTH = 0.1
+HIST_MAX = 20.0
+QUANTILES = {'swh': [0.90, 0.99]}
+# directions are not averaged
+SKIP = {'dirpw'}
+UNITS = {'swh': 'm', 'perpw': 's', 'u': 'm s-1', 'v': 'm s-1', 'wef': 'W m-1'}
+# groups of months per worker process, for a finer progress
+GROUPS_PER_WORKER = 2
+# of the physical memory, for all the worker processes together
+MEMORY_FRACTION = 0.5
+
+
+class CellStats:
+    """Running statistics of a variable at every cell of a grid, with a histogram for
+    quantiles if width is given."""
+
+    def __init__(self, shape, width=None, top=HIST_MAX):
+        self.count = np.zeros(shape, np.int64)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.max = np.full(shape, -np.inf)
+        self.width = width
+        self.hist = None
+        if width is not None:
+            self.hist = np.zeros((int(round(top / width)),) + shape, np.uint32)
+
+    def update(self, x):
+        """Adds fields, an array (steps, *shape) with NaN where the cell is undefined."""
+        x = np.asarray(x, np.float64)
+        valid = ~np.isnan(x)
+        n = valid.sum(0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, np.where(valid, x, 0).sum(0) / n, 0)
+        m2 = np.where(valid, x - mean, 0)
+        self._merge(n, mean, np.square(m2, out=m2).sum(0))
+        self.max = np.maximum(self.max, np.where(valid, x, -np.inf).max(0))
+        if self.hist is not None:
+            nbins = len(self.hist)
+            ncells = self.count.size
+            hist = self.hist.reshape(-1)
+            # a cell appears once in each step, so its bin is incremented only once
+            for field, ok in zip(x.reshape(len(x), ncells), valid.reshape(len(x), ncells)):
+                idx = np.clip((field[ok] / self.width).astype(np.int64), 0, nbins - 1)
+                hist[idx * ncells + np.flatnonzero(ok)] += 1
+
+    def merge(self, other):
+        self._merge(other.count, other.mean, other.m2)
+        self.max = np.maximum(self.max, other.max)
+        if self.hist is not None:
+            self.hist += other.hist
+
+    def _merge(self, n, mean, m2):
+        total = self.count + n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(total > 0, n / total, 0)
+        delta = mean - self.mean
+        self.mean += delta * w
+        self.m2 += m2 + delta ** 2 * self.count * w
+        self.count = total
+
+    def quantile(self, q):
+        """Quantile q of every cell, that of rank floor(q * (n - 1)), interpolated within
+        its bin of the histogram. NaN for cells without values."""
+        rank = np.floor(q * (self.count - 1))
+        below = np.zeros(self.count.shape, np.int64)
+        out = np.full(self.count.shape, np.nan)
+        nbins = len(self.hist)
+        for k in range(nbins):
+            h = self.hist[k]
+            hit = (h > 0) & (rank < below + h) & np.isnan(out)
+            lo = k * self.width
+            hi = np.maximum((k + 1) * self.width, self.max) if k == nbins - 1 else lo + self.width
+            with np.errstate(invalid='ignore', divide='ignore'):
+                # values are taken as evenly spread over the bin
+                value = lo + (rank - below + 0.5) / h * (hi - lo)
+            out[hit] = np.broadcast_to(value, out.shape)[hit]
+            below += h
+        return out
+
+
+def horizontal(ds):
+    """Returns the horizontal dimensions of a GRIB dataset and its latitude and longitude
+    coordinates, as (dims, values) pairs: 1D for regular grids, 2D for curvilinear ones."""
+    lat = ds['latitude']
+    lon = ds['longitude']
+    dims = lat.dims if lat.dims == lon.dims else (lat.dims[0], lon.dims[0])
+    return dims, {'latitude': (lat.dims, lat.values), 'longitude': (lon.dims, lon.values)}
+
+
+def grid_variables(parameters):
+    variables = [v for p in parameters for v in VARS[p] if v not in SKIP]
+    if 'swh' in variables and 'perpw' in variables:
+        variables.append('wef')
+    return variables
+
+
+class GridStats:
+    """CellStats of every variable of the given parameters, and of the wave energy flux
+    with hs and tp, over a grid of horizontal dims, with coords as given by horizontal."""
+
+    def __init__(self, parameters, dims, shape, coords):
+        self.dims = dims
+        self.coords = coords
+        variables = grid_variables(parameters)
+        self.stats = {v: CellStats(shape, HIST_WIDTH if v in QUANTILES else None)
+                      for v in variables}
+        self.months = 0
+
+    def update(self, fields):
+        """Adds the fields of some steps, a dict of (steps, *shape) arrays by variable."""
+        if 'wef' in self.stats:
+            fields = dict(fields, wef=wave_energy_flux(fields['perpw'], fields['swh']))
+        for v, s in self.stats.items():
+            s.update(fields[v])
+
+    def merge(self, other):
+        for v, s in self.stats.items():
+            s.merge(other.stats[v])
+        self.months += other.months
+
+    def to_dataset(self, attrs=None):
+        import xarray as xr
+        dims = self.dims
+        data = {}
+        for v, s in self.stats.items():
+            units = {'units': UNITS[v]}
+            with np.errstate(invalid='ignore', divide='ignore'):
+                data[f'{v}_mean'] = (dims, np.where(s.count > 0, s.mean, np.nan),
+                                     dict(units, long_name=f'mean of {v}'))
+                data[f'{v}_sd'] = (dims, np.sqrt(s.m2 / s.count),
+                                   dict(units, long_name=f'standard deviation of {v}'))
+            data[f'{v}_max'] = (dims, np.where(s.count > 0, s.max, np.nan),
+                                dict(units, long_name=f'maximum of {v}'))
+            for q in QUANTILES.get(v, []):
+                data[f'{v}_p{q * 100:g}'] = (dims, s.quantile(q),
+                                             dict(units, long_name=f'P{q * 100:g} of {v}'))
+            data[f'{v}_count'] = (dims, s.count, {'long_name': f'number of values of {v}'})
+        attrs = dict(attrs or {}, months=self.months,
+                     quantile_bin_width=HIST_WIDTH)
+        return xr.Dataset(data, coords=self.coords, attrs=attrs)
+
+
+def accumulate(grid, parameters, months, callback=None):
+    """Returns the GridStats of the (year, month) pairs of a grid. callback(year, month)
+    is called after each month."""
+    stats = None
+    for year, month in months:
+        dsets = [open_grib(PATH.format(grid=grid, year=year, month=month, param=p))
+                 for p in parameters]
+        dims, coords = horizontal(dsets[0])
+        if stats is None:
+            shape = tuple(dsets[0].sizes[d] for d in dims)
+            stats = GridStats(parameters, dims, shape, coords)
+        # the first step is the last one of the previous month
+        for start in range(1, dsets[0].sizes['step'], STEP_CHUNK):
+            fields = {}
+            for p, ds in zip(parameters, dsets):
+                part = ds.isel(step=slice(start, start + STEP_CHUNK))
+                for v in VARS[p]:
+                    fields[v] = part[v].transpose('step', *dims).values
+            stats.update(fields)
+        for ds in dsets:
+            ds.close()
+        stats.months += 1
+        if callback is not None:
+            callback(year, month)
+    return stats
+
+
+def physical_memory():
+    """Bytes of physical memory, or None where the platform does not tell."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def worker_memory(parameters, ncells):
+    """Approximate bytes a process accumulating the statistics of a grid of ncells holds:
+    the CellStats of every variable and STEP_CHUNK decoded steps of each."""
+    variables = grid_variables(parameters)
+    # count, mean, m2 and max, 8 bytes each
+    stats = 32 * len(variables) + sum(4 * int(round(HIST_MAX / HIST_WIDTH))
+                                      for v in variables if v in QUANTILES)
+    return ncells * (stats + 8 * STEP_CHUNK * (len(variables) + 1))
+
+
+def max_workers(parameters, ncells):
+    """Number of processes whose accumulators fit in MEMORY_FRACTION of the physical
+    memory, or None if it is not known."""
+    total = physical_memory()
+    if total is None:
+        return None
+    return max(1, int(MEMORY_FRACTION * total // worker_memory(parameters, ncells)))
+
+
+def grid_stats(grid, parameters, years, months, workers=None, callback=None):
+    """Accumulates the statistics of a grid over every year and month, split in groups of
+    months across workers processes (default: in this process) and merged. workers is
+    lowered to what fits in memory, see max_workers. callback(year, month) is called as
+    months, or groups of them, are done. Returns a GridStats."""
+    jobs = list(product(years, months))
+    if workers is not None and workers > 1:
+        ds = open_grib(PATH.format(grid=grid, year=years[0], month=months[0], param=parameters[0]))
+        dims, _ = horizontal(ds)
+        bound = max_workers(parameters, int(np.prod([ds.sizes[d] for d in dims])))
+        ds.close()
+        if bound is not None:
+            workers = min(workers, bound)
+    if workers is None or workers < 2:
+        return accumulate(grid, parameters, jobs, callback)
+    groups = [list(map(tuple, g.tolist()))
+              for g in np.array_split(jobs, min(len(jobs), workers * GROUPS_PER_WORKER))]
+    stats = None
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(accumulate, grid, parameters, group): group for group in groups}
+        for future in as_completed(futures):
+            part = future.result()
+            if stats is None:
+                stats = part
+            else:
+                stats.merge(part)
+            if callback is not None:
+                for year, month in futures[future]:
+                    callback(year, month)
+    return stats
+
+
+def write_grid_stats(stats, fname, attrs=None):
+    """Saves a GridStats as a NetCDF file, replacing it at once."""
+    tmp = fname + '.tmp'
+    stats.to_dataset(attrs).to_netcdf(tmp)
+    os.replace(tmp, fname)
+    return fname
@@ -0,0 +1,117 @@
+"""
+Instrumentation of the download and extraction pipelines: stage timers, counters and
+throughput of a run.
+
+Every timed step and notable event is a record (a dict with the pipeline, the event name,
+the seconds elapsed since the run started and its own fields) passed to the sinks of the
+run as it happens, e.g. json_lines(file) to write them one JSON object per line. finish()
+emits and returns the summary: count, total, mean and maximum seconds of each stage with
+its slowest steps, and each counter with its rate over the run.
+"""
+
+import heapq
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# slowest steps kept per stage
+SLOWEST = 5
+
+
+class Metrics:
+    """Timers and counters of a pipeline run, safe to use from several threads."""
+
+    def __init__(self, pipeline, sinks=()):
+        self.pipeline = pipeline
+        self.sinks = list(sinks)
+        self.started = time.time()
+        self.start = time.perf_counter()
+        # stage: [count, total seconds, max seconds]
+        self.stages = {}
+        self.slowest = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def emit(self, event, **fields):
+        record = {'pipeline': self.pipeline, 'event': event,
+                  'elapsed': round(self.elapsed(), 6), **fields}
+        with self.lock:
+            for sink in self.sinks:
+                sink(record)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def rate(self, name):
+        """Count of name per second since the run started."""
+        return self.counters.get(name, 0) / self.elapsed()
+
+    def add_time(self, stage, seconds, **fields):
+        """Records a step of a stage timed elsewhere, e.g. in a worker process."""
+        with self.lock:
+            stats = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            slowest = self.slowest.setdefault(stage, [])
+            # the count breaks ties, fields are not comparable
+            item = (seconds, stats[0], fields)
+            if len(slowest) < SLOWEST:
+                heapq.heappush(slowest, item)
+            else:
+                heapq.heappushpop(slowest, item)
+        self.emit(stage, seconds=round(seconds, 6), **fields)
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        """Times the block as a step of stage. Fields can be added to the yielded dict
+        inside the block, e.g. the bytes it transferred."""
+        t = time.perf_counter()
+        yield fields
+        self.add_time(stage, time.perf_counter() - t, **fields)
+
+    def summary(self):
+        elapsed = self.elapsed()
+        with self.lock:
+            stages = {
+                stage: {'count': n, 'seconds': total, 'mean': total / n, 'max': longest,
+                        'slowest': [dict(f, seconds=s)
+                                    for s, _, f in sorted(self.slowest[stage], reverse=True)]}
+                for stage, (n, total, longest) in self.stages.items()
+            }
+            counters = dict(self.counters)
+        return {'pipeline': self.pipeline, 'started': self.started, 'elapsed': elapsed,
+                'stages': stages, 'counters': counters,
+                'rates': {k: v / elapsed for k, v in counters.items()}}
+
+    def finish(self):
+        """Emits the summary of the run as a 'summary' record and returns it."""
+        summary = self.summary()
+        self.emit('summary', **{k: v for k, v in summary.items() if k != 'pipeline'})
+        return summary
+
+
+def json_lines(file):
+    """Returns a sink writing records to an open text file, one JSON object per line."""
+    def sink(record):
+        file.write(json.dumps(record, default=str) + '\n')
+        file.flush()
+    return sink
+
+
+def format_summary(summary):
+    """Formats a Metrics summary as text, one line per stage and counter."""
+    lines = [f"{summary['pipeline']}: {summary['elapsed']:.1f} s"]
+    for stage, s in summary['stages'].items():
+        slowest = s['slowest'][0]
+        where = ', '.join(f'{k}={v}' for k, v in slowest.items() if k != 'seconds')
+        lines.append(f"  {stage}: {s['count']} in {s['seconds']:.1f} s, mean {s['mean']:.3f} s, "
+                     f"max {s['max']:.3f} s" + (f' ({where})' if where else ''))
+    for name, value in summary['counters'].items():
+        lines.append(f"  {name}: {value} ({summary['rates'][name]:.3g}/s)")
+    return '\n'.join(lines)
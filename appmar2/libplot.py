@@ -1,15 +1,15 @@
+import os
+import threading
+from functools import lru_cache
 from math import tau  # tauday.com - Pi is wrong
 
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mtick
 import numpy as np
-import seaborn as sns
-import statsmodels.api as sm
-import xarray as xr
 from matplotlib import rc
 
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
+from .libappmar2 import pot_month, rose_histogram
+from .libkde import kde_1d, kde_2d
 
 plt.rcParams['mathtext.fontset'] = 'custom'
 plt.rcParams['mathtext.rm'] = 'serif'
@@ -25,59 +25,82 @@ HEIGHT = 2.29
 
 MAPWIDTH = 2.5
 MAPHEIGHT = 1.25
+MAPDPI = 100
+# map regions, degrees: MAPSPAN wide and high, centered on multiples of MAPSTEP, so that
+# nearby sites share the background
+MAPSPAN = (40, 20)
+MAPSTEP = 5
+# relative to APPMAR2_DIR, next to the index cache
+BASEMAP_DIR = os.path.join('cache', 'basemap')
+
+# contour levels of the joint density, the lowest one not shaded
+JOINT_LEVELS = 10
 
-NDIRS = 16
 DIRS = np.linspace(0, 15*tau/16, 16)
-RANGE = (-11.25, 371.25)
 BARWIDTH = tau/16
 
-STR_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+def show(fig, fname=None):
+    """Shows a figure, or saves it to fname and closes it."""
+    if fname is None:
+        fig.show()
+    else:
+        fig.savefig(fname)
+        plt.close(fig)
+
+
+def dist_curves(data):
+    """Returns the histogram (densities and bin edges) and the KDE-based CDF (support and
+    values) drawn by plot_dist."""
+    import seaborn as sns
+    support, _, cdf = kde_1d(data)
+    bins = min(sns.distributions._freedman_diaconis_bins(data), 50)
+    density, edges = np.histogram(data, bins=bins, density=True)
+    return density, edges, support, cdf
 
 
-def plot_dist(data, lbl):
-    kde = sm.nonparametric.KDEUnivariate(data)
-    kde.fit(bw='scott', gridsize=100, cut=0)
+def plot_dist(data, lbl, curves=None, fname=None):
+    if curves is None:
+        curves = dist_curves(data)
+    density, edges, support, cdf = curves
     fig, ax1 = plt.subplots(figsize=(WIDTH, HEIGHT))
     ax2 = ax1.twinx()
-    bins = min(sns.distributions._freedman_diaconis_bins(data), 50)
-    ax1.hist(data, bins=bins, density=True, color='0.75')
-    ax2.plot(kde.support, kde.cdf, color='k')
+    ax1.hist(edges[:-1], bins=edges, weights=density, color='0.75')
+    ax2.plot(support, cdf, color='k')
     ax2.set_ylim([0, ax2.get_ylim()[1]])
     ax1.set_xlabel(lbl)
     ax1.set_ylabel('Probability density')
     ax2.set_ylabel('Cumulative probability')
     fig.tight_layout()
-    fig.show()
+    show(fig, fname)
+
 
+def joint_density(x, y):
+    """Returns the grids and the KDE density (see libkde.kde_2d) drawn by plot_joint."""
+    return kde_2d(x, y)
 
-def plot_joint(x, y, xlbl, ylbl):
+
+def plot_joint(x, y, xlbl, ylbl, density=None, fname=None):
+    import seaborn as sns
+    if density is None:
+        density = joint_density(x, y)
+    gx, gy, z = density
     fig, ax = plt.subplots(figsize=(WIDTH, HEIGHT))
     cmap = sns.cubehelix_palette(rot=0, hue=1, light=1, dark=0, as_cmap=True)
-    sns.kdeplot(x, y, shade=True, shade_lowest=False,
-                cut=0, cbar=True, cbar_kws={'label': 'Probability density'}, cmap=cmap)
+    levels = mtick.MaxNLocator(JOINT_LEVELS).tick_values(0, z.max())
+    cs = ax.contourf(gx, gy, z.T, levels=levels[1:], cmap=cmap, vmin=0, vmax=levels[-1])
+    fig.colorbar(cs, ax=ax, label='Probability density')
     ax.set_xlabel(xlbl)
     ax.set_ylabel(ylbl)
     fig.tight_layout()
-    fig.show()
+    show(fig, fname)
 
 
-def roseplot(d, x, bins=5, quantiles=False, opening=1.0, dirnames=False, xlabel=None, cmap=None, ax=None):
-    if quantiles:
-        bin_edges = np.quantile(x, np.linspace(0, 1, bins + 1))
-    else:
-        bin_edges = np.histogram_bin_edges(x, bins)
-    bin_edges[-1] = np.inf
-    n = len(d)
-    hists = np.empty((bins, NDIRS))
-    lbls = []
-    for i in range(bins):
-        x1 = bin_edges[i]
-        x2 = bin_edges[i + 1]
-        dbin = d[np.logical_and(x1 <= x, x < x2)]
-        *hists[i], last = np.histogram(
-            dbin, bins=NDIRS + 1, range=RANGE)[0] / n
-        hists[i, 0] += last
-        lbls.append(f'{x1:.1f}–{x2:.1f}')
+def roseplot(d, x, bins=5, quantiles=False, opening=1.0, dirnames=False, xlabel=None, cmap=None, ax=None,
+             table=None):
+    if table is None:
+        table = rose_histogram(d, x, bins, quantiles)
+    hists, _, lbls = table
     if ax is None:
         ax = plt.subplot(polar=True)
     ax.set_theta_direction(-1)
@@ -86,7 +109,7 @@ def roseplot(d, x, bins=5, quantiles=False, opening=1.0, dirnames=False, xlabel=
         ax.set_xticklabels(['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW'])
     if isinstance(cmap, str) or cmap is None:
         cmap = plt.get_cmap(cmap)
-    colors = cmap(np.linspace(0, 1, bins))
+    colors = cmap(np.linspace(0, 1, len(hists)))
     bottoms = np.empty_like(hists)
     bottoms[0] = 0
     bottoms[1:] = np.cumsum(hists[:-1], 0)
@@ -98,34 +121,76 @@ def roseplot(d, x, bins=5, quantiles=False, opening=1.0, dirnames=False, xlabel=
     return ax
 
 
-def plot_rose(d, x, lbl):
+def plot_rose(d, x, lbl, table=None, fname=None):
     fig, ax = plt.subplots(figsize=(WIDTH, HEIGHT),
                            subplot_kw={'projection': 'polar'})
-    roseplot(d, x, dirnames=True, xlabel=lbl, ax=ax)
+    roseplot(d, x, dirnames=True, xlabel=lbl, ax=ax, table=table)
     fig.tight_layout()
-    fig.show()
-
-
-def save_map(filename, lon, lat):
-    fig, ax = plt.subplots(figsize=(MAPWIDTH, MAPHEIGHT), subplot_kw={
-                           'projection': ccrs.PlateCarree()})
-    fig.subplots_adjust(right=0.995, bottom=0.005,
-                        top=1, left=0)  # remove borders
+    show(fig, fname)
+
+
+def map_extent(lon, lat):
+    """Returns the extent (west, east, south, north) of the map region of a site."""
+    width, height = MAPSPAN
+    clon = MAPSTEP * round(lon / MAPSTEP)
+    clat = min(max(MAPSTEP * round(lat / MAPSTEP), height / 2 - 90), 90 - height / 2)
+    return (clon - width / 2, clon + width / 2, clat - height / 2, clat + height / 2)
+
+
+def render_basemap(fname, extent):
+    """Renders the background of a map region to a PNG file: land, ocean, coastlines,
+    borders, lakes and rivers, filling the whole image."""
+    import cartopy.crs as ccrs
+    import cartopy.feature as cfeature
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(MAPWIDTH, MAPHEIGHT))
+    ax = fig.add_axes([0, 0, 1, 1], projection=ccrs.PlateCarree())
+    ax.set_extent(extent, crs=ccrs.PlateCarree())
+    # pixels are then linear in longitude and latitude over the whole extent
+    ax.set_aspect('auto')
     ax.gridlines(linewidth=0.5, color='black', alpha=0.2, linestyle='--')
-    zoom = 10  # center the view
-    ax.set_extent([lon-(zoom*2.4), lon+(zoom*1.9), lat-zoom, lat+zoom])
-    ax.plot(lon, lat, markersize=4, marker='v',
-             color='red', transform=ccrs.Geodetic())
     ax.add_feature(cfeature.LAND)
     ax.add_feature(cfeature.OCEAN)
     ax.add_feature(cfeature.COASTLINE, linewidth=0.5)
     ax.add_feature(cfeature.BORDERS, linewidth=0.5, linestyle=':')
     ax.add_feature(cfeature.LAKES, alpha=0.2)
     ax.add_feature(cfeature.RIVERS, linewidth=0.5)
-    fig.savefig(filename, dpi=100)
+    tmp = f'{fname}.{os.getpid()}-{threading.get_ident()}.tmp'
+    fig.savefig(tmp, dpi=MAPDPI, format='png')
+    os.replace(tmp, fname)
+
+
+@lru_cache(maxsize=16)
+def basemap(extent):
+    """Returns the background image of a map region, rendered only the first time it is
+    asked for and kept in BASEMAP_DIR."""
+    import matplotlib.image as mimage
+    key = '_'.join(f'{v:g}' for v in extent)
+    fname = os.path.join(BASEMAP_DIR, f'{key}_{MAPWIDTH:g}x{MAPHEIGHT:g}@{MAPDPI}.png')
+    if not os.path.exists(fname):
+        os.makedirs(BASEMAP_DIR, exist_ok=True)
+        render_basemap(fname, extent)
+    return mimage.imread(fname)
 
 
-def plot_clusters(pairs, centers, labels):
+def save_map(filename, lon, lat):
+    """Saves the map of a site, to a file name or a file object: the cached background of
+    its region with the site marked. Only the marker is drawn, without pyplot, so it can
+    run outside the UI thread."""
+    from matplotlib.figure import Figure
+    extent = map_extent(lon, lat)
+    fig = Figure(figsize=(MAPWIDTH, MAPHEIGHT))
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.imshow(basemap(extent), extent=extent, aspect='auto', interpolation='none')
+    ax.plot(lon, lat, markersize=4, marker='v', color='red')
+    ax.set_xlim(extent[:2])
+    ax.set_ylim(extent[2:])
+    ax.set_axis_off()
+    fig.savefig(filename, dpi=MAPDPI, format='png')
+
+
+def plot_clusters(pairs, centers, labels, fname=None):
+    import seaborn as sns
     fig, ax = plt.subplots(figsize=(WIDTH, HEIGHT))
     sns.scatterplot(x=pairs[:, 0], y=pairs[:, 1], hue=labels.astype(str), ax=ax, s=2)
     ax.get_legend().remove()
@@ -133,20 +198,43 @@ def plot_clusters(pairs, centers, labels):
     ax.set_xlabel("Significant wave height (m)")
     ax.set_ylabel("Period (s)")
     fig.tight_layout()
-    fig.show()
+    show(fig, fname)
+
 
-def plot_pot_month(df, str_p):
-    q = int(str_p) / 100
-    th = df.swh.quantile(q)
-    nyears = len(df.time.dt.year.unique())
-    pot = df.time[df.swh > th].groupby(df.time.dt.month).agg({"count"}) / nyears
+def plot_pot_month(df, str_p, pot=None, fname=None):
+    if pot is None:
+        pot = pot_month(df, str_p)
+    months, npeaks, th = pot
     fig, ax = plt.subplots(figsize=(WIDTH, HEIGHT))
-    npeaks = pot.values.flatten()
-    b = ax.bar(STR_MONTHS, npeaks, color="gray", label=f"$H_s$ > {th:.2f} m (P{str_p})")
+    b = ax.bar(months, npeaks, color="gray", label=f"$H_s$ > {th:.2f} m (P{str_p})")
     # ax.bar_label(b, fmt="%.1f", size=6)
     ax.set_ylabel("Average number of events per year")
     ax.tick_params(axis="x", labelrotation=60)
     ax.legend(handlelength=0,handletextpad=0, frameon=False)
     fig.tight_layout()
-    fig.show()
-    return (STR_MONTHS, npeaks, th)
\ No newline at end of file
+    show(fig, fname)
+    return (months, npeaks, th)
+
+
+def plot_return_levels(result, lbl, fname=None):
+    """Plots the return level curve of a libextreme.fit_extremes result with its bootstrap
+    confidence band, and the sample at its empirical return periods."""
+    from .libextreme import return_levels
+    rate = result['rate']
+    periods = np.geomspace(max(1.1 / rate, 1), 200, 100)
+    levels, lower, upper = return_levels(result, periods)
+    x = np.sort(result['sample'])[::-1] + result['threshold']
+    t = (len(x) + 1) / np.arange(1, len(x) + 1) / rate
+    keep = t >= periods[0]
+    fig, ax = plt.subplots(figsize=(WIDTH, HEIGHT))
+    ax.fill_between(periods, lower, upper, color='0.85',
+                    label=f"{result['confidence']:.0%} confidence interval")
+    ax.plot(periods, levels, color='k', label='Return level')
+    ax.scatter(t[keep], x[keep], s=4, color='k', marker='o', label='Sample')
+    ax.set_xscale('log')
+    ax.xaxis.set_major_formatter(mtick.FormatStrFormatter('%g'))
+    ax.set_xlabel('Return period (years)')
+    ax.set_ylabel(lbl)
+    ax.legend(frameon=False)
+    fig.tight_layout()
+    show(fig, fname)
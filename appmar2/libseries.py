@@ -0,0 +1,181 @@
+"""
+Writers and readers of extracted time series.
+
+Besides CSV, series can be stored in a compact binary format: a fixed-size JSON header
+holding the point metadata, followed by one record per time step (time and step as
+int64 nanoseconds, variables in their native float32). Records are appended while
+extracting and read back memory-mapped.
+
+Next to each file, a small JSON record of its blocks lists the variables written for each
+month and the size of the file once they were, so that an extraction can be resumed or
+extended with the missing blocks only.
+"""
+
+import json
+import os
+
+import numpy as np
+
+MAGIC = b'APPMAR2S'
+HEADER_SIZE = 4096
+EXTENSIONS = {'csv': '.csv', 'series': '.series'}
+BLOCKS_EXT = '.blocks'
+TMP_EXT = '.tmp'
+
+
+class CSVWriter:
+    """Appends to a new file, or to an existing one truncated to size."""
+
+    def __init__(self, fname, meta=None, size=None):
+        self.fname = fname
+        if size is None:
+            open(fname, 'x').close()
+            size = 0
+        else:
+            os.truncate(fname, size)
+        self.size = size
+        self.header = size == 0
+
+    def append(self, df):
+        with open(self.fname, 'a') as f:
+            df.to_csv(f, header=self.header)
+        self.size = os.path.getsize(self.fname)
+        self.header = False
+
+
+class SeriesWriter:
+    """Appends to a new file, or to an existing one truncated to size."""
+
+    def __init__(self, fname, meta=None, size=None):
+        self.fname = fname
+        if size is None:
+            self.meta = dict(meta or {}, nrows=0)
+            self.dtype = None
+            with open(fname, 'xb') as f:
+                self.write_header(f)
+            self.size = HEADER_SIZE
+            return
+        os.truncate(fname, size)
+        self.meta = dict(read_header(fname), nrows=0)
+        self.dtype = None
+        if 'dtype' in self.meta:
+            self.dtype = np.dtype([tuple(d) for d in self.meta['dtype']])
+            self.meta['nrows'] = (size - HEADER_SIZE) // self.dtype.itemsize
+        with open(fname, 'r+b') as f:
+            self.write_header(f)
+        self.size = size
+
+    def write_header(self, f):
+        header = MAGIC + json.dumps(self.meta).encode()
+        if len(header) > HEADER_SIZE:
+            raise ValueError('Series metadata too large.')
+        f.seek(0)
+        f.write(header.ljust(HEADER_SIZE, b' '))
+
+    def append(self, df):
+        """Appends a DataFrame indexed by (time, step) as written by extract_series."""
+        df = df.reset_index()
+        if self.dtype is None:
+            self.dtype = np.dtype([
+                (str(col), '<i8' if df[col].dtype.kind in 'mM' else df[col].dtype.str)
+                for col in df.columns
+            ])
+            self.meta['dtype'] = self.dtype.descr
+        records = np.empty(len(df), self.dtype)
+        for col in self.dtype.names:
+            values = df[col].to_numpy()
+            if values.dtype.kind == 'M':
+                values = values.astype('datetime64[ns]').view('<i8')
+            elif values.dtype.kind == 'm':
+                values = values.astype('timedelta64[ns]').view('<i8')
+            records[col] = values
+        with open(self.fname, 'r+b') as f:
+            f.seek(HEADER_SIZE + self.meta['nrows'] * self.dtype.itemsize)
+            f.write(records.tobytes())
+            # the header is updated last, an interrupted write leaves a consistent file
+            self.meta['nrows'] += len(records)
+            self.write_header(f)
+        self.size = HEADER_SIZE + self.meta['nrows'] * self.dtype.itemsize
+
+
+WRITERS = {'csv': CSVWriter, 'series': SeriesWriter}
+
+
+def read_blocks(fname):
+    """Returns the recorded size of a series file and the variables written for each of its
+    months, {'YYYY-MM': [variables]}, or None if they were not recorded. A replacement of
+    the file that was recorded but interrupted (see write_blocks) is completed first."""
+    try:
+        with open(fname + BLOCKS_EXT) as f:
+            blocks = json.load(f)
+    except FileNotFoundError:
+        return None
+    tmp = fname + TMP_EXT
+    if os.path.exists(tmp):
+        if os.path.getsize(tmp) == blocks['size']:
+            os.replace(tmp, fname)
+        else:
+            os.remove(tmp)
+    return blocks['size'], blocks['months']
+
+
+def write_blocks(fname, size, months):
+    """Records the blocks of a series file. The record is replaced at once; to replace the
+    file too, write the new one as fname + TMP_EXT, record it and then move it."""
+    path = fname + BLOCKS_EXT
+    with open(path + TMP_EXT, 'w') as f:
+        json.dump({'size': size, 'months': months}, f)
+    os.replace(path + TMP_EXT, path)
+
+
+def read_header(fname):
+    with open(fname, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if not header.startswith(MAGIC):
+        raise ValueError(f'{fname} is not an APPMAR 2 series file.')
+    return json.loads(header[len(MAGIC):])
+
+
+def read_series(fname):
+    """Returns the metadata and the records of a series file, memory-mapped."""
+    meta = read_header(fname)
+    if meta['nrows'] == 0:
+        return meta, np.empty(0, [tuple(d) for d in meta.get('dtype', [])])
+    dtype = np.dtype([tuple(d) for d in meta['dtype']])
+    records = np.memmap(fname, dtype, mode='r', offset=HEADER_SIZE,
+                        shape=(meta['nrows'],))
+    return meta, records
+
+
+def load_series_file(fname):
+    """Loads a series file as a DataFrame with the same columns as a loaded CSV file."""
+    _, records = read_series(fname)
+    return records_frame(records)
+
+
+def records_frame(records):
+    """Returns the DataFrame of series records, without copying them."""
+    import pandas as pd
+    columns = {}
+    for col in records.dtype.names:
+        values = records[col]
+        if col == 'time':
+            values = values.view('datetime64[ns]')
+        elif col == 'step':
+            values = values.view('timedelta64[ns]')
+        columns[col] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+def export_csv(fname, csv_fname):
+    """Writes a series file as CSV, in the same format extract_series writes."""
+    df = load_series_file(fname)
+    writer = CSVWriter(csv_fname)
+    # one month at a time, like the extraction does, so values format the same way
+    for _, month in df.groupby('time', sort=False):
+        writer.append(month.set_index(['time', 'step']))
+    return csv_fname
+
+
+def is_series_file(fname):
+    return os.path.splitext(fname)[1] == EXTENSIONS['series']
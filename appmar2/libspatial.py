@@ -0,0 +1,119 @@
+"""
+Spatial index of the grids: the nearest wet cell of any number of points in one
+vectorized query, for regular, curvilinear and unstructured grids alike.
+
+Cells are placed on the unit sphere, where the chord between two points grows with their
+great-circle distance, and the wet ones (with data at some step of a month, so cells
+under seasonal ice count as wet) are put in a KD-tree. The cell coordinates and the wet
+mask are cached to disk per grid in SPATIAL_DIR; the tree is rebuilt from them, which
+takes far less than decoding the month they come from.
+"""
+
+import os
+
+import numpy as np
+
+# relative to APPMAR2_DIR, next to the index cache
+SPATIAL_DIR = os.path.join('cache', 'spatial')
+EARTH_RADIUS = 6371.0  # km
+# points farther than this many cell spacings from any wet cell are out of the grid
+MAX_CELLS = 3
+# steps of a month decoded at a time for the wet mask
+STEP_CHUNK = 24
+
+
+def unit_xyz(lat, lon):
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], -1)
+
+
+def chord_km(d):
+    """Great-circle distance, km, of a chord of the unit sphere."""
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(d / 2, 0, 1))
+
+
+class GridIndex:
+    """Nearest wet cells of a grid. dims are the names of its horizontal dimensions,
+    latitude, longitude and wet arrays of their shape."""
+
+    def __init__(self, dims, latitude, longitude, wet):
+        from scipy.spatial import cKDTree
+        self.dims = tuple(dims)
+        self.latitude = latitude
+        self.longitude = longitude
+        self.wet = wet
+        self.cells = np.flatnonzero(wet)
+        self.tree = cKDTree(unit_xyz(latitude.ravel()[self.cells],
+                                     longitude.ravel()[self.cells]))
+        # typical distance between neighbouring wet cells, from a sample of them
+        sample = self.tree.data[::max(1, len(self.cells) // 1000)]
+        d, _ = self.tree.query(sample, k=2)
+        self.spacing = float(chord_km(np.median(d[:, 1]))) if len(self.cells) > 1 else np.inf
+        # points farther from any wet cell, km, are out of the grid
+        self.max_distance = MAX_CELLS * self.spacing
+
+    @classmethod
+    def from_dataset(cls, ds):
+        """Builds the index of the grid of a dataset, GRIB or store: its cells are wet
+        where its first variable has data at some step."""
+        lat = ds['latitude']
+        lon = ds['longitude']
+        if lat.dims == lon.dims:
+            # curvilinear (y, x) or unstructured (values) grid
+            dims = lat.dims
+            latitude, longitude = lat.values, lon.values
+        else:
+            dims = (lat.dims[0], lon.dims[0])
+            latitude, longitude = np.meshgrid(lat.values, lon.values, indexing='ij')
+        darr = ds[list(ds.data_vars)[0]]
+        other = [d for d in darr.dims if d not in dims]
+        wet = np.zeros(latitude.shape, bool)
+        time = other[0] if other else None
+        for start in range(0, darr.sizes[time] if time else 1, STEP_CHUNK):
+            part = darr.isel({time: slice(start, start + STEP_CHUNK)}) if time else darr
+            wet |= part.notnull().any(other).transpose(*dims).values
+        return cls(dims, latitude, longitude, wet)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as f:
+            return cls(f['dims'].tolist(), f['latitude'], f['longitude'], f['wet'])
+
+    def save(self, fname):
+        tmp = fname + '.tmp.npz'
+        np.savez(tmp, dims=np.array(self.dims), latitude=self.latitude,
+                 longitude=self.longitude, wet=self.wet)
+        os.replace(tmp, fname)
+
+    def query(self, lats, lons):
+        """Returns the indices of the nearest wet cells of the points, a tuple with an
+        array for each of dims, and their distance in km."""
+        d, k = self.tree.query(unit_xyz(np.asarray(lats, np.float64),
+                                        np.asarray(lons, np.float64)))
+        return np.unravel_index(self.cells[k], self.wet.shape), chord_km(d)
+
+    def indexers(self, lats, lons):
+        """Returns the isel indexers of the nearest wet cells of the points, along a new
+        'point' dimension."""
+        import xarray as xr
+        idx, _ = self.query(lats, lons)
+        return {dim: xr.DataArray(i, dims='point') for dim, i in zip(self.dims, idx)}
+
+
+_indexes = {}
+
+
+def grid_index(grid, source):
+    """Returns the GridIndex of a grid, from memory or from the disk cache. The first
+    time, it is built from the dataset returned by source() and cached."""
+    fname = os.path.abspath(os.path.join(SPATIAL_DIR, f'{grid}.npz'))
+    if fname not in _indexes:
+        if os.path.exists(fname):
+            index = GridIndex.load(fname)
+        else:
+            index = GridIndex.from_dataset(source())
+            os.makedirs(SPATIAL_DIR, exist_ok=True)
+            index.save(fname)
+        _indexes[fname] = index
+    return _indexes[fname]
@@ -1,29 +1,144 @@
+import time
 import warnings
+from multiprocessing import connection, get_context
 
 import numpy as np
 from scipy import stats
 
-DISTRIBUTIONS = [stats.alpha, stats.anglit, stats.arcsine, stats.argus, stats.beta, stats.betaprime, stats.bradford, stats.burr, stats.burr12, stats.cauchy, stats.chi, stats.chi2, stats.cosine, stats.crystalball, stats.dgamma, stats.dweibull, stats.erlang, stats.expon, stats.exponnorm, stats.exponweib, stats.exponpow, stats.f, stats.fatiguelife, stats.fisk, stats.foldcauchy, stats.foldnorm, stats.frechet_r, stats.frechet_l, stats.genlogistic, stats.gennorm, stats.genpareto, stats.genexpon, stats.genextreme, stats.gausshyper, stats.gamma, stats.gengamma, stats.genhalflogistic, stats.gilbrat, stats.gompertz, stats.gumbel_r, stats.gumbel_l, stats.halfcauchy, stats.halflogistic, stats.halfnorm, stats.halfgennorm, stats.hypsecant, stats.invgamma, stats.invgauss,
-                 stats.invweibull, stats.johnsonsb, stats.johnsonsu, stats.kappa4, stats.kappa3, stats.ksone, stats.kstwobign, stats.laplace, stats.levy, stats.levy_l, stats.levy_stable, stats.logistic, stats.loggamma, stats.loglaplace, stats.lognorm, stats.lomax, stats.maxwell, stats.mielke, stats.moyal, stats.nakagami, stats.ncx2, stats.ncf, stats.nct, stats.norm, stats.norminvgauss, stats.pareto, stats.pearson3, stats.powerlaw, stats.powerlognorm, stats.powernorm, stats.rdist, stats.reciprocal, stats.rayleigh, stats.rice, stats.recipinvgauss, stats.semicircular, stats.skewnorm, stats.t, stats.trapz, stats.triang, stats.truncexpon, stats.truncnorm, stats.tukeylambda, stats.uniform, stats.vonmises, stats.vonmises_line, stats.wald, stats.weibull_min, stats.weibull_max, stats.wrapcauchy]
+# some of these were renamed or removed in recent SciPy versions
+DISTRIBUTION_NAMES = [
+    'alpha', 'anglit', 'arcsine', 'argus', 'beta', 'betaprime', 'bradford', 'burr',
+    'burr12', 'cauchy', 'chi', 'chi2', 'cosine', 'crystalball', 'dgamma', 'dweibull',
+    'erlang', 'expon', 'exponnorm', 'exponweib', 'exponpow', 'f', 'fatiguelife', 'fisk',
+    'foldcauchy', 'foldnorm', 'frechet_r', 'frechet_l', 'genlogistic', 'gennorm',
+    'genpareto', 'genexpon', 'genextreme', 'gausshyper', 'gamma', 'gengamma',
+    'genhalflogistic', 'gilbrat', 'gompertz', 'gumbel_r', 'gumbel_l', 'halfcauchy',
+    'halflogistic', 'halfnorm', 'halfgennorm', 'hypsecant', 'invgamma', 'invgauss',
+    'invweibull', 'johnsonsb', 'johnsonsu', 'kappa4', 'kappa3', 'ksone', 'kstwobign',
+    'laplace', 'levy', 'levy_l', 'levy_stable', 'logistic', 'loggamma', 'loglaplace',
+    'lognorm', 'lomax', 'maxwell', 'mielke', 'moyal', 'nakagami', 'ncx2', 'ncf', 'nct',
+    'norm', 'norminvgauss', 'pareto', 'pearson3', 'powerlaw', 'powerlognorm',
+    'powernorm', 'rdist', 'reciprocal', 'rayleigh', 'rice', 'recipinvgauss',
+    'semicircular', 'skewnorm', 't', 'trapz', 'triang', 'truncexpon', 'truncnorm',
+    'tukeylambda', 'uniform', 'vonmises', 'vonmises_line', 'wald', 'weibull_min',
+    'weibull_max', 'wrapcauchy'
+]
+DISTRIBUTIONS = [getattr(stats, name) for name in DISTRIBUTION_NAMES if hasattr(stats, name)]
 
 
-def fit_and_test_all(data, pbfun=None):
+def fit_and_test(dist, data, **kwds):
+    """Fits dist to data and returns the parameters and the Kolmogorov-Smirnov statistic.
+    Keyword arguments, e.g. floc=0 to fix the location, are passed to dist.fit."""
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore')
+        # fit dist to data
+        params = dist.fit(data, **kwds)
+        # perform Kolmogorov-Smirnov test
+        d, _ = stats.kstest(data, dist.cdf, args=params)
+    return params, d
+
+
+def _fit_worker(name, data, conn):
+    try:
+        conn.send(fit_and_test(getattr(stats, name), data))
+    except Exception as e:
+        conn.send(e)
+    conn.close()
+
+
+def _fit_parallel(dists, data, workers, timeout, pbfun):
+    """Runs fit_and_test for every distribution in its own process, at most workers at a time.
+    Processes running for longer than timeout seconds are killed."""
+    ctx = get_context()
+    pending = list(dists)
+    running = {}
+    results = {}
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                dist = pending.pop(0)
+                recv, send = ctx.Pipe(duplex=False)
+                proc = ctx.Process(target=_fit_worker,
+                                   args=(dist.name, data, send), daemon=True)
+                proc.start()
+                send.close()
+                running[recv] = (proc, dist, time.monotonic())
+            for conn in connection.wait(list(running), timeout=0.1):
+                proc, dist, _ = running.pop(conn)
+                try:
+                    results[dist] = conn.recv()
+                except EOFError:  # the worker died
+                    pass
+                conn.close()
+                proc.join()
+                if pbfun is not None:
+                    pbfun(1)
+            if timeout is None:
+                continue
+            now = time.monotonic()
+            for conn, (proc, dist, start) in list(running.items()):
+                if now - start > timeout:
+                    proc.kill()
+                    proc.join()
+                    conn.close()
+                    del running[conn]
+                    if pbfun is not None:
+                        pbfun(1)
+    finally:
+        for conn, (proc, _, _) in running.items():
+            proc.kill()
+            conn.close()
+    return results
+
+
+def _fit_all(dists, data, workers, timeout, pbfun):
+    if workers is None and timeout is None:
+        results = {}
+        for dist in dists:
+            try:
+                results[dist] = fit_and_test(dist, data)
+            except RuntimeError as e:
+                results[dist] = e
+            if pbfun is not None:
+                pbfun(1)
+    else:
+        results = _fit_parallel(dists, data, workers or 1, timeout, pbfun)
     fits = []
-    for dist in DISTRIBUTIONS:
-        try:
-            with warnings.catch_warnings():
-                warnings.filterwarnings('ignore')
-                # fit dist to data
-                params = dist.fit(data)
-                # perform Kolmogorov-Smirnov test
-                d, _ = stats.kstest(data, dist.cdf, args=params)
-                fits.append((dist, params, d))
-        except RuntimeError:
-            pass
-        if pbfun is not None:
-            pbfun(1)
+    for dist in dists:
+        result = results.get(dist)
+        if isinstance(result, RuntimeError) or result is None:
+            continue
+        if isinstance(result, Exception):
+            raise result
+        fits.append((dist, *result))
     fits.sort(key=lambda x: x[2])
     return fits
 
-annual_max = data.groupby(lambda i: data.iloc[i].time.split('-')[0]).max()
-hmax = np.sort(annual_max.swh)
\ No newline at end of file
+
+def fit_and_test_all(data, pbfun=None, workers=None, timeout=None, screen=None, keep=20, seed=0):
+    """Fits every distribution in DISTRIBUTIONS to data and returns a list of
+    (dist, params, ks_statistic) tuples, best fit first.
+
+    workers -- number of processes fitting in parallel (default: fit in this process).
+    timeout -- seconds after which a fit is abandoned; it runs in a worker process.
+    screen -- size of a random subsample to which all the distributions are fitted first;
+        only the keep best of them are then fitted to the whole data.
+
+    pbfun(1) is called after each fit, i.e. len(DISTRIBUTIONS) times, plus keep more
+    times when screening.
+    """
+    dists = DISTRIBUTIONS
+    if screen is not None and screen < len(data):
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(data, screen, replace=False)
+        fits = _fit_all(dists, sample, workers, timeout, pbfun)
+        dists = [dist for dist, _, _ in fits[:keep]]
+    return _fit_all(dists, data, workers, timeout, pbfun)
+
+
+def fits_report(fits, t, n=10):
+    """Returns the n best fits of fit_and_test_all as text."""
+    txt = f"*{t}*\nDistribution, KS statistic, parameters\n"
+    for dist, params, d in fits[:n]:
+        txt += f"{dist.name}, {d:.4f}, " + ", ".join(f"{p:.4g}" for p in params) + "\n"
+    return txt
@@ -0,0 +1,79 @@
+import os
+import shutil
+
+import numpy as np
+
+# relative to APPMAR2_DIR, next to the monthly GRIB files of the grid
+STORE_PATH = 'nopp-phase2/multi_reanal.{grid}.zarr'
+# time-long, space-small chunks: a point series spans few chunks
+TIME_CHUNK = 24 * 366
+SPACE_CHUNK = 16
+
+
+def store_path(grid):
+    return STORE_PATH.format(grid=grid)
+
+
+def open_store(grid):
+    """Opens the point-optimized store of a grid, or returns None if it was not converted."""
+    path = store_path(grid)
+    if not os.path.exists(path):
+        return None
+    import xarray as xr
+    return xr.open_zarr(path)
+
+
+def to_store_layout(ds):
+    """Turns a monthly GRIB dataset into the store layout: one 'valid_time' dimension shared
+    by all months, with the month reference time and the step kept as coordinates."""
+    ds = ds.swap_dims(step='valid_time')
+    n = ds.sizes['valid_time']
+    coords = {
+        'time': ('valid_time', np.full(n, ds.time.values)),
+        'step': ('valid_time', ds.step.values)
+    }
+    return ds.reset_coords(drop=True).assign_coords(coords)
+
+
+def append_month(path, ds, time_chunk=TIME_CHUNK, space_chunk=SPACE_CHUNK):
+    ds = to_store_layout(ds)
+    if not os.path.exists(path):
+        encoding = {
+            v: {'chunks': (time_chunk, space_chunk, space_chunk)} for v in ds.data_vars
+        }
+        ds.to_zarr(path, mode='w', encoding=encoding)
+    else:
+        ds.to_zarr(path, append_dim='valid_time')
+
+
+def remove_store(path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+
+def store_extractor(store, indexers, varmap, fallback):
+    """Returns a loader f(year, month, param) reading from a store with the same output as
+    multi_extractor, at the grid points given by indexers (see GridIndex.indexers). The
+    series of all the points are read at once on first use, which touches only the few
+    chunks holding them. Parameters whose variables (given by varmap) are missing from the
+    store, or months it does not cover, are loaded with fallback(year, month, param)."""
+    cache = {}
+
+    def f(year, month, param):
+        variables = varmap[param]
+        if any(v not in store for v in variables):
+            return fallback(year, month, param)
+        if not cache:
+            cache['ds'] = ds = store.isel(indexers).load()
+            cache['year'] = ds.time.dt.year.values
+            cache['month'] = ds.time.dt.month.values
+        mask = (cache['year'] == year) & (cache['month'] == month)
+        if not mask.any():
+            # a month outside the years converted
+            return fallback(year, month, param)
+        ds = cache['ds'][variables].isel(valid_time=mask)
+        # restore the GRIB layout: a 'step' dimension and a scalar reference time
+        ds = ds.swap_dims(valid_time='step')
+        return ds.assign_coords(time=ds.time.values[0])
+    return f
+
@@ -0,0 +1,211 @@
+"""
+Streaming statistics of time series files, for series too long to load at once.
+
+Series are read chunk by chunk, from CSV or binary series files, into mergeable
+accumulators whose size does not depend on the length of the series:
+
+- Moments: count, mean and standard deviation, merged with Chan's parallel update, in
+  float64 whatever the dtype of the data.
+- QuantileSketch: quantiles with a relative error bound. Values are counted in
+  logarithmic buckets (gamma**(i-1), gamma**i], gamma = (1 + alpha) / (1 - alpha), and a
+  quantile is reported as the center 2 * gamma**i / (gamma + 1) of the bucket holding it.
+  For any q, the estimate x is within |x - x_q| <= alpha * |x_q| of x_q, the exact
+  quantile of rank floor(q * (n - 1)) (np.quantile with method='lower'), a deterministic
+  bound. Values of magnitude below min_value are counted as zeros, an absolute error
+  below min_value. With the defaults (alpha 0.5 %, min_value 1e-6) a sketch of values
+  up to 1e3 holds at most about 2000 buckets per sign.
+
+np.quantile interpolates linearly between ranks by default; its result differs from the
+'lower' one at most by the gap between consecutive values, negligible for long series.
+NaN values are ignored.
+"""
+
+import numpy as np
+
+from .libappmar2 import STR_MONTHS, csv_dtypes, parse_times
+from .libseries import is_series_file, read_series, records_frame
+
+# rows read at a time
+CHUNK_ROWS = 1 << 16
+ALPHA = 0.005
+MIN_VALUE = 1e-6
+
+
+def iter_series(fname, columns=None, chunksize=CHUNK_ROWS):
+    """Yields a series file as DataFrames of at most chunksize rows, with the columns
+    (all of them by default) of load_series."""
+    if is_series_file(fname):
+        _, records = read_series(fname)
+        if columns is not None:
+            records = records[columns]
+        for start in range(0, len(records), chunksize):
+            yield records_frame(records[start:start + chunksize])
+        return
+    import pandas as pd
+    dtype = csv_dtypes(fname)
+    with pd.read_csv(fname, dtype=dtype, usecols=columns, chunksize=chunksize) as reader:
+        for df in reader:
+            yield parse_times(df, dtype is not None)
+
+
+class Moments:
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x):
+        x = np.asarray(x, np.float64)
+        x = x[~np.isnan(x)]
+        if len(x):
+            mean = x.mean()
+            self._merge(len(x), mean, np.square(x - mean).sum())
+
+    def merge(self, other):
+        self._merge(other.count, other.mean, other.m2)
+
+    def _merge(self, n, mean, m2):
+        if n == 0:
+            return
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+    @property
+    def sd(self):
+        # population standard deviation, like np.std
+        return np.sqrt(self.m2 / self.count) if self.count else np.nan
+
+
+class Buckets:
+    """Counts of consecutive bucket indices, grown as needed."""
+
+    def __init__(self):
+        self.offset = 0
+        self.counts = np.zeros(0, np.int64)
+
+    def grow(self, lo, hi):
+        if len(self.counts) == 0:
+            self.offset = lo
+            self.counts = np.zeros(hi - lo + 1, np.int64)
+            return
+        new_lo = min(lo, self.offset)
+        new_hi = max(hi, self.offset + len(self.counts) - 1)
+        if new_lo < self.offset or new_hi >= self.offset + len(self.counts):
+            counts = np.zeros(new_hi - new_lo + 1, np.int64)
+            start = self.offset - new_lo
+            counts[start:start + len(self.counts)] = self.counts
+            self.offset = new_lo
+            self.counts = counts
+
+    def add(self, idx):
+        if len(idx):
+            self.grow(int(idx.min()), int(idx.max()))
+            self.counts += np.bincount(idx - self.offset, minlength=len(self.counts))
+
+    def merge(self, other):
+        if len(other.counts):
+            self.grow(other.offset, other.offset + len(other.counts) - 1)
+            start = other.offset - self.offset
+            self.counts[start:start + len(other.counts)] += other.counts
+
+
+class QuantileSketch:
+
+    def __init__(self, alpha=ALPHA, min_value=MIN_VALUE):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = np.log(self.gamma)
+        self.min_value = min_value
+        self.positive = Buckets()
+        self.negative = Buckets()
+        self.zeros = 0
+        self.count = 0
+
+    def update(self, x):
+        x = np.asarray(x, np.float64)
+        x = x[~np.isnan(x)]
+        self.count += len(x)
+        ax = np.abs(x)
+        large = ax >= self.min_value
+        self.zeros += len(x) - np.count_nonzero(large)
+        for buckets, sel in ((self.positive, large & (x > 0)), (self.negative, large & (x < 0))):
+            buckets.add(np.ceil(np.log(ax[sel]) / self.log_gamma).astype(np.int64))
+
+    def merge(self, other):
+        if other.gamma != self.gamma or other.min_value != self.min_value:
+            raise ValueError('Sketches with different accuracy cannot be merged.')
+        self.positive.merge(other.positive)
+        self.negative.merge(other.negative)
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def value(self, i):
+        return 2 * self.gamma ** i / (self.gamma + 1)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = int(np.floor(q * (self.count - 1)))
+        # negative values come first, from the largest magnitude down
+        counts = self.negative.counts[::-1]
+        if rank < counts.sum():
+            j = np.searchsorted(np.cumsum(counts), rank, side='right')
+            return -self.value(self.negative.offset + len(counts) - 1 - j)
+        rank -= counts.sum()
+        if rank < self.zeros:
+            return 0.0
+        rank -= self.zeros
+        j = np.searchsorted(np.cumsum(self.positive.counts), rank, side='right')
+        return self.value(self.positive.offset + j)
+
+
+class SeriesStats:
+    """Moments and quantile sketch of a variable, for the statistics of summary()."""
+
+    def __init__(self, alpha=ALPHA):
+        self.moments = Moments()
+        self.sketch = QuantileSketch(alpha)
+
+    def update(self, x):
+        self.moments.update(x)
+        self.sketch.update(x)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+
+    def summary(self):
+        p25, p50, p75 = (self.sketch.quantile(q) for q in (0.25, 0.50, 0.75))
+        return {'mean': self.moments.mean, 'sd': self.moments.sd,
+                'p25': p25, 'p50': p50, 'p75': p75}
+
+
+def stream_summary(fname, variables=('swh', 'perpw'), alpha=ALPHA, chunksize=CHUNK_ROWS):
+    """Returns the summary() statistics of each variable of a series file, read in one
+    pass, with quantiles within relative error alpha."""
+    stats = {v: SeriesStats(alpha) for v in variables}
+    for df in iter_series(fname, ['time', *variables], chunksize):
+        for v, s in stats.items():
+            s.update(df[v].values)
+    return {v: s.summary() for v, s in stats.items()}
+
+
+def stream_pot_month(fname, str_p, alpha=ALPHA, chunksize=CHUNK_ROWS):
+    """Streaming pot_month. A first pass estimates the threshold, within relative error
+    alpha, and a second one counts the exceedances of each month exactly. All the months
+    are returned, with 0 events for months without exceedances."""
+    sketch = QuantileSketch(alpha)
+    for df in iter_series(fname, ['time', 'swh'], chunksize):
+        sketch.update(df['swh'].values)
+    th = sketch.quantile(int(str_p) / 100)
+    counts = np.zeros(13, np.int64)
+    years = set()
+    for df in iter_series(fname, ['time', 'swh'], chunksize):
+        time = df['time'].dt
+        years.update(np.unique(time.year.values).tolist())
+        counts += np.bincount(time.month.values[df['swh'].values > th], minlength=13)
+    return (STR_MONTHS, counts[1:] / max(len(years), 1), th)
@@ -0,0 +1,145 @@
+"""
+Background tasks of the main window: downloads, extractions and analyses run in a pool of
+worker threads while the Tk main loop keeps the window responsive.
+
+Workers never touch Tk. Their progress and their outcome (result, error or cancellation)
+are put in a queue that the main loop polls with after() every POLL_MS, calling the
+handlers of each task there. A task is cancelled cooperatively: cancel() sets a flag that
+the next task.progress() or task.check() in the worker turns into Cancelled, so progress
+callbacks of long operations stop them between files or months; a task still waiting in
+the pool is dropped at once.
+
+Long tasks (downloads and extractions, submitted with long=True) have their own pool of
+LONG_WORKERS, so that analyses are not queued behind them; analyses and map renderings
+share the WORKERS of the other pool.
+"""
+
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+POLL_MS = 100
+WORKERS = 2
+LONG_WORKERS = 1
+
+
+class Cancelled(Exception):
+    """Raised in a worker by a task that was cancelled."""
+
+
+class Task:
+
+    def __init__(self, scheduler, name, handlers):
+        self.scheduler = scheduler
+        self.name = name
+        self.handlers = handlers
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self._cancel.set()
+        if self.future.cancel():
+            # it never started, so no worker reports it
+            self.scheduler.post(self, 'cancel')
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled(self.name)
+
+    def progress(self, *args):
+        """Reports progress from the worker, passed to on_progress(*args) in the main loop.
+        Raises Cancelled if the task was cancelled."""
+        self.check()
+        self.scheduler.post(self, 'progress', *args)
+
+
+class TaskScheduler:
+    """Runs tasks in pools of worker threads and delivers their events to the Tk main
+    loop of root."""
+
+    def __init__(self, root, workers=WORKERS, long_workers=LONG_WORKERS, poll=POLL_MS):
+        self.root = root
+        self.poll_ms = poll
+        self.pools = {
+            False: ThreadPoolExecutor(workers, thread_name_prefix='appmar2-task'),
+            True: ThreadPoolExecutor(long_workers, thread_name_prefix='appmar2-long-task')
+        }
+        self.events = queue.SimpleQueue()
+        self.tasks = set()
+        self.polling = False
+
+    def submit(self, func, *args, name=None, long=False, on_progress=None, on_done=None,
+               on_error=None, on_cancel=None):
+        """Runs func(task, *args) in a worker, of the pool of long tasks if long. In the main
+        loop, on_progress(*args) is called for each task.progress(*args), then
+        on_done(result), on_error(exception) or on_cancel() once it ends. Must be called
+        from the main loop."""
+        handlers = {'progress': on_progress, 'done': on_done, 'error': on_error,
+                    'cancel': on_cancel}
+        task = Task(self, name or getattr(func, '__name__', 'task'), handlers)
+        self.tasks.add(task)
+        task.future = self.pools[long].submit(self._run, task, func, args)
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_ms, self.poll)
+        return task
+
+    def _run(self, task, func, args):
+        try:
+            task.check()
+            result = func(task, *args)
+        except Cancelled:
+            self.post(task, 'cancel')
+        except Exception as e:
+            self.post(task, 'error', e)
+        else:
+            self.post(task, 'done', result)
+
+    def post(self, task, kind, *args):
+        self.events.put((task, kind, args))
+
+    def poll(self):
+        """Delivers the queued events to the handlers of their tasks, then polls again while
+        any task is pending."""
+        try:
+            while True:
+                try:
+                    task, kind, args = self.events.get_nowait()
+                except queue.Empty:
+                    break
+                if task.cancelled:
+                    # late progress, results and failures, e.g. of a worker stopped
+                    # halfway, of a cancelled task are dropped
+                    if kind == 'progress':
+                        continue
+                    kind, args = 'cancel', ()
+                if kind != 'progress':
+                    self.tasks.discard(task)
+                handler = task.handlers[kind]
+                if handler is not None:
+                    handler(*args)
+                elif kind == 'error':
+                    # as Tk does with the exceptions of its callbacks
+                    e = args[0]
+                    traceback.print_exception(type(e), e, e.__traceback__)
+        finally:
+            self.polling = bool(self.tasks) or not self.events.empty()
+            if self.polling:
+                self.root.after(self.poll_ms, self.poll)
+
+    def cancel_all(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    def shutdown(self):
+        """Cancels the tasks and lets the workers end, without waiting for them."""
+        self.cancel_all()
+        for pool in self.pools.values():
+            pool.shutdown(wait=False)
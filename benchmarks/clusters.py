@@ -0,0 +1,62 @@
+"""
+Wall-clock time of compute_clusters against the previous implementation (full KMeans
+for every k and a refit of the chosen one), on synthetic (Hs, Tp) pairs.
+
+    python benchmarks/clusters.py [sizes ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from appmar2.libappmar2 import compute_clusters
+
+
+def compute_clusters_previous(pairs):
+    from kneed import KneeLocator
+    from sklearn.cluster import KMeans
+    from sklearn.preprocessing import StandardScaler
+    scaler = StandardScaler()
+    scaled_pairs = scaler.fit_transform(pairs)
+    sse = []
+    for k in range(1, 11):
+        kmeans = KMeans(n_clusters=k)
+        kmeans.fit(scaled_pairs)
+        sse.append(kmeans.inertia_)
+    kl = KneeLocator(range(1, 11), sse, curve="convex", direction="decreasing")
+    k = kl.elbow
+    kmeans = KMeans(n_clusters=k)
+    kmeans.fit(scaled_pairs)
+    centers = scaler.inverse_transform(kmeans.cluster_centers_)
+    labels = kmeans.labels_
+    return centers, labels
+
+
+def make_pairs(n, seed=0):
+    """Sea states drawn from a few (Hs, Tp) regimes: wind sea, swell and storms."""
+    rng = np.random.default_rng(seed)
+    regime = rng.choice(3, n, p=[0.6, 0.3, 0.1])
+    hs = rng.gamma(np.array([4, 6, 8])[regime], np.array([0.25, 0.3, 0.5])[regime])
+    tp = rng.normal(np.array([6, 11, 13])[regime], np.array([1, 1.5, 2])[regime])
+    return np.column_stack((hs, tp))
+
+
+def main(argv):
+    sizes = [int(n) for n in argv] or [10000, 100000, 270000]
+    # warm up imports and the thread pools
+    compute_clusters_previous(make_pairs(1000))
+    print('pairs     previous (s, k)   compute_clusters (s, k)   minibatch (s, k)')
+    for n in sizes:
+        pairs = make_pairs(n)
+        cells = []
+        for f in (compute_clusters_previous, compute_clusters,
+                  lambda p: compute_clusters(p, minibatch=True)):
+            t = time.perf_counter()
+            centers, _ = f(pairs)
+            cells.append(f'{time.perf_counter() - t:8.2f} {len(centers):3d}')
+        print(f'{n:8d}  {cells[0]}          {cells[1]}                {cells[2]}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
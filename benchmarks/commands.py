@@ -0,0 +1,97 @@
+"""
+Checks of the command-line interface on synthetic series of some months of each year, as
+extracted for a season, and of whole years: the peaks command, and the peaks of the
+manifests of the batch command, report the 12 months with the average number of
+exceedances per year of each one, 0 for the months out of the series. Exits with status 1
+if any check fails.
+
+    python benchmarks/commands.py
+"""
+
+import io
+import json
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from appmar2.cli import main as cli
+from appmar2.libappmar2 import STR_MONTHS, load_series
+from appmar2.libbatch import MANIFEST
+from fixtures import write_fixture
+
+YEARS = 3
+PERCENTILE = '95'
+# months of each year of the series
+SERIES = {'season': (1, 2, 3), 'year': range(1, 13)}
+# of the events per year, printed by the report
+TOL = 1e-6
+
+
+def run(*argv):
+    """Returns the exit status and the output of an appmar2 command."""
+    out = io.StringIO()
+    with redirect_stdout(out):
+        status = cli(list(argv))
+    return status, out.getvalue()
+
+
+def report_counts(txt):
+    """Returns the events per year of each month in a peaks report."""
+    counts = {}
+    for line in txt.splitlines():
+        name, _, value = line.partition(': ')
+        if name in STR_MONTHS:
+            counts[name] = float(value)
+    return [counts.get(m) for m in STR_MONTHS]
+
+
+def expected_counts(fname):
+    """Average number of exceedances per year of each month, counted directly."""
+    df = load_series(fname)
+    th = df['swh'].quantile(int(PERCENTILE) / 100)
+    time = df['time'].dt
+    counts = np.bincount(time.month.values[df['swh'].values > th], minlength=13)[1:]
+    return counts / len(np.unique(time.year.values))
+
+
+def check_peaks(fname):
+    status, out = run('peaks', fname, '-p', PERCENTILE)
+    counts = report_counts(out)
+    return status == 0 and None not in counts and np.allclose(
+        counts, expected_counts(fname), rtol=0, atol=TOL)
+
+
+def check_batch(fname, outdir):
+    """Checks the peaks of the manifest written by the batch command for a series."""
+    name = os.path.splitext(os.path.basename(fname))[0]
+    with open(os.path.join(outdir, name, MANIFEST)) as f:
+        manifest = json.load(f)
+    peaks = manifest.get('peaks', {})
+    return ('peaks' not in manifest['errors'] and 'peaks' in manifest['figures']
+            and peaks.get('months') == STR_MONTHS and np.allclose(
+                peaks.get('events_per_year'), expected_counts(fname), rtol=0, atol=TOL))
+
+
+def main(argv):
+    failed = False
+    print('series  months  peaks  batch')
+    with tempfile.TemporaryDirectory() as tmp:
+        fnames = {}
+        for name, months in SERIES.items():
+            fnames[name] = os.path.join(tmp, f'appmar2-{name}.csv')
+            write_fixture(fnames[name], YEARS, months=months)
+        outdir = os.path.join(tmp, 'reports')
+        status, _ = run('batch', tmp, '-o', outdir, '--workers', '1', '-p', PERCENTILE)
+        for name, fname in fnames.items():
+            checks = [check_peaks(fname), status == 0 and check_batch(fname, outdir)]
+            failed |= not all(checks)
+            print(f'{name:6s}  {len(SERIES[name]):6d}  '
+                  + '  '.join(f'{"ok" if ok else "FAIL":5s}' for ok in checks))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,208 @@
+"""
+Checks of the resumable, concurrent downloads of download_grib and download_gribs against
+a local HTTP server with Range support, without network: files downloaded whole by
+several workers, existing files skipped without a request, partial '.part' files resumed
+from their size, transfers cut short kept as '.part' files and resumed by the next run,
+missing files and Content-Range headers that do not start at the requested offset raised
+as OSError. Exits with status 1 if any check fails.
+
+    python benchmarks/download.py
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from appmar2.libappmar2 import PATH, download_grib, download_gribs
+
+GRID = 'test'
+PARAMS = ['hs', 'tp']
+YEARS = [1979]
+MONTHS = [1, 2, 3]
+SIZE = 1 << 20
+WORKERS = 2
+
+
+def content(path):
+    """Bytes served for a path, the same on every request."""
+    seed = int(hashlib.md5(path.encode()).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).integers(0, 256, SIZE, np.uint8).tobytes()
+
+
+class Server(ThreadingHTTPServer):
+    """Serves content(path) for every path but those in missing, with 404. faults[path] is
+    'truncate' to cut the response in half, 'ignore-range' to answer a Range request with
+    a 206 from the start of the file. Requests are logged as (path, Range header)."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.missing = set()
+        self.faults = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url_base(self):
+        return f'http://127.0.0.1:{self.server_port}/'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.lstrip('/')
+        rng = self.headers.get('Range')
+        with server.lock:
+            server.requests.append((path, rng))
+            fault = server.faults.get(path)
+        if path in server.missing:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data = content(path)
+        start = int(rng[len('bytes='):].rstrip('-')) if rng else 0
+        if fault == 'ignore-range':
+            start = 0
+        if rng:
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        body = data[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if fault == 'truncate':
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+def metadata(param, month):
+    return dict(grid=GRID, param=param, year=YEARS[0], month=month)
+
+
+def downloaded(path):
+    if not os.path.exists(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read() == content(path)
+
+
+def raises(func, *args, **kwargs):
+    """Returns the message of the OSError raised by func, None if it returned."""
+    try:
+        func(*args, **kwargs)
+    except OSError as e:
+        return str(e)
+    return None
+
+
+def check_concurrent(server):
+    done = []
+    download_gribs(GRID, PARAMS, YEARS, MONTHS, workers=WORKERS, url_base=server.url_base,
+                   callback=lambda *key: done.append(key))
+    paths = [PATH.format(**metadata(p, m)) for p in PARAMS for m in MONTHS]
+    return len(done) == len(paths) and all(downloaded(p) for p in paths)
+
+
+def check_skip(server):
+    server.requests.clear()
+    download_gribs(GRID, PARAMS, YEARS, MONTHS, workers=WORKERS, url_base=server.url_base)
+    return not server.requests
+
+
+def check_resume(server):
+    meta = metadata(PARAMS[0], 4)
+    path = PATH.format(**meta)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.part', 'wb') as f:
+        f.write(content(path)[:SIZE // 4])
+    server.requests.clear()
+    n = download_grib(url_base=server.url_base, **meta)
+    return (n == SIZE - SIZE // 4 and server.requests == [(path, f'bytes={SIZE // 4}-')]
+            and downloaded(path) and not os.path.exists(path + '.part'))
+
+
+def check_truncated(server):
+    meta = metadata(PARAMS[0], 5)
+    path = PATH.format(**meta)
+    server.faults[path] = 'truncate'
+    error = raises(download_grib, url_base=server.url_base, **meta)
+    kept = os.path.exists(path + '.part') and not os.path.exists(path)
+    size = os.path.getsize(path + '.part') if kept else 0
+    del server.faults[path]
+    n = download_grib(url_base=server.url_base, **meta)
+    return (error is not None and 'Incomplete' in error and kept and 0 < size < SIZE
+            and n == SIZE - size and downloaded(path))
+
+
+def check_missing(server):
+    meta = metadata(PARAMS[0], 6)
+    path = PATH.format(**meta)
+    server.missing.add(path)
+    error = raises(download_grib, url_base=server.url_base, **meta)
+    return (error is not None and '404' in error and not os.path.exists(path)
+            and not os.path.exists(path + '.part'))
+
+
+def check_offset(server):
+    meta = metadata(PARAMS[0], 7)
+    path = PATH.format(**meta)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    head = content(path)[:SIZE // 4]
+    with open(path + '.part', 'wb') as f:
+        f.write(head)
+    server.faults[path] = 'ignore-range'
+    error = raises(download_grib, url_base=server.url_base, **meta)
+    untouched = os.path.exists(path + '.part') and os.path.getsize(path + '.part') == len(head)
+    return (error is not None and 'Content-Range' in error and untouched
+            and not os.path.exists(path))
+
+
+CHECKS = {
+    'concurrent': check_concurrent,
+    'skip': check_skip,
+    'resume': check_resume,
+    'truncated': check_truncated,
+    'missing': check_missing,
+    'offset': check_offset
+}
+
+
+def main(argv):
+    failed = False
+    server = Server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            for name, check in CHECKS.items():
+                try:
+                    ok, error = check(server), ''
+                except Exception as e:
+                    ok, error = False, f'  {type(e).__name__}: {e}'
+                failed |= not ok
+                print(f'{name:10s}  {"ok" if ok else "FAIL"}{error}')
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+            server.server_close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,48 @@
+"""
+Wall-clock time of the bootstrap of libextreme.fit_extremes, GEV on annual maxima and
+GPD on storm peaks, on a synthetic 31-year hourly series: in this process and spread
+over worker processes. Replicates are drawn up front from the seed, so every run must
+give the same confidence intervals.
+
+    python benchmarks/extremes.py [replicates] [workers]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from appmar2.libappmar2 import load_series
+from appmar2.libextreme import fit_extremes, return_levels
+from fixtures import write_fixture
+
+YEARS = 31
+
+
+def main(argv):
+    replicates = int(argv[0]) if argv else 1000
+    workers = int(argv[1]) if len(argv) > 1 else os.cpu_count()
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, 'appmar2-extremes.csv')
+        write_fixture(fname, YEARS)
+        df = load_series(fname)
+    print(f'{replicates} replicates, {workers} workers')
+    print('model  sample  serial (s)  parallel (s)  replicates/s  100-year level [CI]')
+    for model in ('gev', 'gpd'):
+        runs = []
+        for w in (None, workers):
+            t = time.perf_counter()
+            result = fit_extremes(df, model, '95', replicates=replicates, workers=w)
+            runs.append((time.perf_counter() - t, result))
+        (serial, r1), (parallel, r2) = runs
+        same = np.array_equal(r1['boot'], r2['boot'], equal_nan=True)
+        (level,), (lower,), (upper,) = return_levels(r2, [100])
+        print(f'{model:5s}  {len(r2["sample"]):6d}  {serial:10.2f}  {parallel:12.2f}  '
+              f'{replicates / parallel:12.1f}  {level:.2f} [{lower:.2f}, {upper:.2f}]'
+              + ('' if same else '  replicates differ'))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
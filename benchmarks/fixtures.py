@@ -0,0 +1,97 @@
+"""
+Synthetic data for the benchmarks, generated locally: extracted series in the CSV layout
+of extract_series, and GRIB2 hindcast files in the layout of the WAVEWATCH III archive
+(PATH, one file per grid, parameter and month, 3-hourly steps from the first of the
+month), written with eccodes.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from appmar2.libappmar2 import PATH, VARS
+
+# GRIB short names of the variables of each parameter
+SHORT_NAMES = {'hs': 'swh', 'tp': 'perpw', 'dp': 'dirpw'}
+# grid of the GRIB files, degrees
+LAT0, LON0, STEP = 30.0, 270.0, 0.5
+NLAT, NLON = 41, 61
+HOURS = 3
+
+
+def write_fixture(fname, years, freq='1h', seed=0, months=None):
+    """Writes a synthetic series in the CSV layout written by extract_series, of the given
+    months of each year (all of them by default)."""
+    rng = np.random.default_rng(seed)
+    with open(fname, 'w') as f:
+        header = True
+        for month in pd.date_range('1979-01-01', periods=12 * years, freq='MS'):
+            if months is not None and month.month not in months:
+                continue
+            valid = pd.date_range(month, month + pd.offsets.MonthBegin(), freq=freq)
+            n = len(valid)
+            df = pd.DataFrame({
+                'time': month,
+                'step': valid - month,
+                'swh': rng.gamma(2, 0.5, n).astype('float32'),
+                'perpw': rng.gamma(8, 1, n).astype('float32'),
+                'dirpw': (rng.random(n) * 360).astype('float32'),
+                'u': rng.normal(0, 5, n).astype('float32'),
+                'v': rng.normal(0, 5, n).astype('float32')
+            }).set_index(['time', 'step'])
+            df[1:].to_csv(f, header=header)
+            header = False
+
+
+def grib_values(param, shape, rng):
+    if param == 'hs':
+        return rng.gamma(2, 0.5, shape)
+    if param == 'tp':
+        return rng.gamma(8, 1, shape)
+    return rng.random(shape) * 360
+
+
+def write_grib(path, param, year, month, nlat=NLAT, nlon=NLON, seed=0):
+    """Writes a month of 3-hourly fields of a parameter. The first row of the grid is
+    land, missing values as in the coastal points of the hindcast grids."""
+    import eccodes
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(year=year, month=month, day=1)
+    hours = int((start + pd.offsets.MonthBegin() - start) / pd.Timedelta('1h'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.part', 'wb') as f:
+        for step in range(0, hours + 1, HOURS):
+            gid = eccodes.codes_grib_new_from_samples('regular_ll_sfc_grib2')
+            for key, value in [
+                ('centre', 7), ('dataDate', year * 10000 + month * 100 + 1), ('dataTime', 0),
+                ('Ni', nlon), ('Nj', nlat),
+                ('latitudeOfFirstGridPointInDegrees', LAT0),
+                ('latitudeOfLastGridPointInDegrees', LAT0 - STEP * (nlat - 1)),
+                ('longitudeOfFirstGridPointInDegrees', LON0),
+                ('longitudeOfLastGridPointInDegrees', LON0 + STEP * (nlon - 1)),
+                ('iDirectionIncrementInDegrees', STEP), ('jDirectionIncrementInDegrees', STEP),
+                ('shortName', SHORT_NAMES[param]), ('stepUnits', 1), ('forecastTime', step),
+                ('bitmapPresent', 1), ('missingValue', 9999)
+            ]:
+                eccodes.codes_set(gid, key, value)
+            values = grib_values(param, nlat * nlon, rng)
+            values[:nlon] = 9999
+            eccodes.codes_set_values(gid, values)
+            eccodes.codes_write(gid, f)
+            eccodes.codes_release(gid)
+    os.replace(path + '.part', path)
+
+
+def write_archive(grid, params, years, months, nlat=NLAT, nlon=NLON):
+    """Writes the GRIB files of a grid under the current directory, skipping those that
+    exist. Returns a (lat, lon) inside the grid, away from land."""
+    for year in years:
+        for month in months:
+            for k, param in enumerate(params):
+                assert param in SHORT_NAMES, f'no fixture for {VARS[param]}'
+                path = PATH.format(grid=grid, param=param, year=year, month=month)
+                if not os.path.exists(path):
+                    write_grib(path, param, year, month, nlat, nlon,
+                               seed=(year * 100 + month) * 10 + k)
+    return LAT0 - STEP * nlat / 2, LON0 + STEP * nlon / 2
@@ -0,0 +1,54 @@
+"""
+Import-time guard for the APPMAR 2 entry points.
+
+Each module is imported in a fresh interpreter; the best of several runs must stay
+within its budget and none of the heavy dependencies, which are imported on first
+use, may be loaded. Exits with status 1 on a regression.
+
+    python benchmarks/import_time.py
+"""
+
+import subprocess
+import sys
+
+# seconds
+BUDGETS = {
+    'appmar2.appmar2': 1.0,
+    'appmar2.cli': 0.5
+}
+HEAVY = ['cartopy', 'cfgrib', 'kneed', 'matplotlib', 'pandas', 'scipy', 'seaborn',
+         'sklearn', 'statsmodels', 'xarray', 'zarr']
+REPEAT = 5
+
+CODE = """
+import sys, time
+t = time.perf_counter()
+import {module}
+print(time.perf_counter() - t)
+print(' '.join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def measure(module):
+    best = float('inf')
+    for _ in range(REPEAT):
+        out = subprocess.run([sys.executable, '-c', CODE.format(module=module, heavy=HEAVY)],
+                             capture_output=True, text=True, check=True).stdout
+        seconds, loaded = out.split('\n')[:2]
+        best = min(best, float(seconds))
+    return best, loaded.split()
+
+
+def main():
+    failed = False
+    for module, budget in BUDGETS.items():
+        seconds, loaded = measure(module)
+        ok = seconds <= budget and not loaded
+        failed |= not ok
+        print(f"{'ok' if ok else 'FAIL'} {module}: {seconds:.3f} s (budget {budget} s)"
+              + (f", eagerly imports {', '.join(loaded)}" if loaded else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Accuracy and time of the binned KDE of libkde against the KDE evaluated exactly at every
+point of its grid, on synthetic series of several lengths (years of hourly records).
+
+1D: the density and CDF of the swh (dist_curves), and the CDF of the statsmodels
+KDEUnivariate the plots used before, at its support, if statsmodels is installed. 2D: the
+joint density of swh and perpw (joint_density) against the exact product kernel KDE with
+the same bandwidths; seaborn's kdeplot evaluates a KDE like this one at every point of its
+grid. Errors of the densities are relative to their peak. Exits with status 1 if any
+error is above tolerance.
+
+    python benchmarks/kde.py [years ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from appmar2.libappmar2 import load_series
+from appmar2.libkde import kde_1d, kde_2d, scott_bw
+from fixtures import write_fixture
+
+# of the densities, relative to their peak, and of the CDFs
+DENSITY_TOL = 0.01
+CDF_TOL = 0.002
+# values at a time of the exact evaluations
+CHUNK = 20000
+
+
+def timed(func, *args):
+    t = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t
+
+
+def gaussian(g, x, bw):
+    return np.exp(-0.5 * ((g[:, None] - x) / bw) ** 2) / (np.sqrt(2 * np.pi) * bw)
+
+
+def exact_1d(x, g):
+    from scipy.special import ndtr
+    bw = scott_bw(x)
+    density = np.zeros(len(g))
+    cdf = np.zeros(len(g))
+    for start in range(0, len(x), CHUNK):
+        part = x[start:start + CHUNK]
+        density += gaussian(g, part, bw).sum(1)
+        cdf += ndtr((g[:, None] - part) / bw).sum(1)
+    return density / len(x), cdf / len(x)
+
+
+def exact_2d(x, y, gx, gy):
+    bx, by = scott_bw(x), scott_bw(y)
+    density = np.zeros((len(gx), len(gy)))
+    for start in range(0, len(x), CHUNK):
+        part = slice(start, start + CHUNK)
+        density += gaussian(gx, x[part], bx) @ gaussian(gy, y[part], by).T
+    return density / len(x)
+
+
+def statsmodels_cdf(x):
+    """The CDF of dist_curves before libkde, None without statsmodels."""
+    try:
+        import statsmodels.api as sm
+    except ImportError:
+        return None
+    kde = sm.nonparametric.KDEUnivariate(x)
+    kde.fit(bw='scott', gridsize=100, cut=0)
+    return kde.support, kde.cdf
+
+
+def main(argv):
+    sizes = [int(y) for y in argv] or [1, 10, 31]
+    failed = False
+    # scipy is imported out of the timings
+    kde_1d(np.arange(3.0))
+    print('years  values  case    grid        binned (s)  exact (s)  density error  '
+          'CDF error  statsmodels (s, CDF error)')
+    with tempfile.TemporaryDirectory() as tmp:
+        for years in sizes:
+            fname = os.path.join(tmp, f'appmar2-{years}.csv')
+            write_fixture(fname, years)
+            df = load_series(fname)
+            x = df['swh'].values.astype(np.float64)
+            y = df['perpw'].values.astype(np.float64)
+
+            (g, density, cdf), t1 = timed(kde_1d, x)
+            (ex_density, ex_cdf), t2 = timed(exact_1d, x, g)
+            d_err = np.abs(density - ex_density).max() / ex_density.max()
+            c_err = np.abs(cdf - ex_cdf).max()
+            old, t3 = timed(statsmodels_cdf, x)
+            old_err = np.nan if old is None else np.abs(np.interp(old[0], g, cdf) - old[1]).max()
+            ok = d_err <= DENSITY_TOL and c_err <= CDF_TOL and not old_err > CDF_TOL
+            failed |= not ok
+            print(f'{years:5d}  {len(x):6d}  1D      {len(g):9d}  {t1:10.3f}  {t2:9.3f}  '
+                  f'{d_err:13.2%}  {c_err:9.5f}  '
+                  + ('-' if old is None else f'{t3:8.3f} {old_err:.5f}')
+                  + ('' if ok else '  FAIL'))
+
+            (gx, gy, density), t1 = timed(kde_2d, x, y)
+            ex_density, t2 = timed(exact_2d, x, y, gx, gy)
+            d_err = np.abs(density - ex_density).max() / ex_density.max()
+            ok = d_err <= DENSITY_TOL
+            failed |= not ok
+            print(f'{years:5d}  {len(x):6d}  2D      {len(gx):4d}x{len(gy):<4d}  {t1:10.3f}  '
+                  f'{t2:9.3f}  {d_err:13.2%}' + ('' if ok else '  FAIL'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,55 @@
+"""
+Load time and memory of an extracted CSV series: the previous path (per-row
+datetime.strptime through a Python date parser, float64 columns) against
+libappmar2.load_series.
+
+    python benchmarks/load_csv.py [years ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+from appmar2.libappmar2 import load_series
+from fixtures import write_fixture
+
+
+def load_previous(fname):
+    df = pd.read_csv(fname)
+    df['time'] = [datetime.strptime(x, '%Y-%m-%d') for x in df['time']]
+    return df
+
+
+def measure(load, fname):
+    t = time.perf_counter()
+    df = load(fname)
+    seconds = time.perf_counter() - t
+    # tracing slows allocations down, memory is measured on a second, untimed load
+    del df
+    tracemalloc.start()
+    df = load(fname)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, df.memory_usage(deep=True).sum()
+
+
+def main(argv):
+    sizes = [int(y) for y in argv] or [1, 10, 31]
+    print('years  rows      previous (s, peak MB, frame MB)  load_series (s, peak MB, frame MB)')
+    with tempfile.TemporaryDirectory() as tmp:
+        for years in sizes:
+            fname = os.path.join(tmp, f'appmar2-{years}.csv')
+            write_fixture(fname, years)
+            rows = sum(1 for _ in open(fname)) - 1
+            results = [measure(load, fname) for load in (load_previous, load_series)]
+            cells = ['{:8.3f} {:8.1f} {:8.1f}'.format(s, p / 2**20, m / 2**20) for s, p, m in results]
+            print(f'{years:5d}  {rows:8d}  {cells[0]}        {cells[1]}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
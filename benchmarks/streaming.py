@@ -0,0 +1,156 @@
+"""
+Accuracy and memory of the streaming statistics of libstream against the in-memory
+ones, on synthetic series of several lengths (years of hourly records), in CSV and
+binary series files.
+
+Checks the documented bounds: quantiles of swh, perpw and of the signed wind components
+within relative error alpha of the exact 'lower' quantiles, sketches merged from chunks
+equal to one sketch of all the data, mean and SD as the in-memory ones, and a streaming
+peak memory, read in chunks of CHUNK rows, that does not grow with the length of the
+series: the peak of the longest series within FLAT_TOL of that of the shortest one. On a
+series of SEASON months of each year, stream_pot_month must give the months of pot_month,
+with no events in the same ones, and the exact counts over its own threshold. Exits with
+status 1 if any check fails.
+
+    python benchmarks/streaming.py [years ...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from appmar2.libappmar2 import load_series, pot_month, summary
+from appmar2.libseries import SeriesWriter
+from appmar2.libstream import ALPHA, QuantileSketch, stream_pot_month, stream_summary
+from fixtures import write_fixture
+
+QUANTILES = np.concatenate([[0, 0.001, 0.01], np.linspace(0.05, 0.95, 19), [0.99, 0.999, 1]])
+# float32 data averaged in float32 by np.mean, against float64 here
+MOMENTS_RTOL = 1e-5
+# rounding of the bucket computations
+TOL = 1e-9
+# rows read at a time, far fewer than a year of hourly records, so that every series
+# is read in several chunks
+CHUNK = 2000
+# of the streaming peaks, longest series over shortest one
+FLAT_TOL = 1.5
+# months of each year of the series with months without exceedances
+SEASON = (1, 2, 3)
+
+
+def write_series(csv_fname, fname):
+    df = load_series(csv_fname).set_index(['time', 'step'])
+    SeriesWriter(fname).append(df)
+
+
+def check_quantiles(x, chunksize):
+    """Returns the largest error of the sketch quantiles relative to the bound, <= 1 if
+    the bound holds, and whether merged chunk sketches equal a sketch of all of x."""
+    whole = QuantileSketch()
+    whole.update(x)
+    merged = QuantileSketch()
+    for start in range(0, len(x), chunksize):
+        part = QuantileSketch()
+        part.update(x[start:start + chunksize])
+        merged.merge(part)
+    exact = np.quantile(x.astype(np.float64), QUANTILES, method='lower')
+    est = np.array([whole.quantile(q) for q in QUANTILES])
+    ratio = np.max(np.abs(est - exact) / (ALPHA * np.abs(exact)), initial=0, where=exact != 0)
+    same = all(merged.quantile(q) == e for q, e in zip(QUANTILES, est))
+    return ratio, same
+
+
+def measure(func, *args):
+    t = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - t
+    # tracing slows allocations down, memory is measured on a second, untimed run
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def in_memory(fname):
+    df = load_series(fname)
+    return {v: summary(df[v].values) for v in ('swh', 'perpw')}
+
+
+def streaming(fname):
+    return stream_summary(fname, chunksize=CHUNK)
+
+
+def check_pot_month(fname):
+    """Whether stream_pot_month and pot_month agree on a series file."""
+    df = load_series(fname)
+    months, npeaks, _ = pot_month(df, '95')
+    s_months, s_npeaks, th = stream_pot_month(fname, '95', chunksize=CHUNK)
+    time = df['time'].dt
+    counts = np.bincount(time.month.values[df['swh'].values > th], minlength=13)[1:]
+    exact = counts / len(np.unique(time.year.values))
+    return (list(s_months) == list(months) and len(s_npeaks) == len(npeaks) == 12
+            and np.array_equal(s_npeaks == 0, npeaks == 0)
+            and np.allclose(s_npeaks, exact, rtol=0, atol=TOL))
+
+
+def main(argv):
+    sizes = [int(y) for y in argv] or [1, 10, 31]
+    failed = False
+    # streaming peaks of each file type, by length
+    peaks = {}
+    print('years  file     in memory (s, peak MB)  streaming (s, peak MB)  '
+          'quantile error/bound  merge  moments  peaks threshold error')
+    with tempfile.TemporaryDirectory() as tmp:
+        for years in sizes:
+            csv_fname = os.path.join(tmp, f'appmar2-{years}.csv')
+            write_fixture(csv_fname, years)
+            fname = os.path.join(tmp, f'appmar2-{years}.series')
+            write_series(csv_fname, fname)
+            for f in (csv_fname, fname):
+                exact, t1, p1 = measure(in_memory, f)
+                stream, t2, p2 = measure(streaming, f)
+                peaks.setdefault(os.path.splitext(f)[1], []).append((years, p2))
+                df = load_series(f)
+                ratio, same = 0, True
+                for v in ('swh', 'perpw', 'u', 'v'):
+                    r, s = check_quantiles(df[v].values, 100000)
+                    ratio, same = max(ratio, r), same and s
+                moments = all(
+                    np.isclose(stream[v][k], exact[v][k], rtol=MOMENTS_RTOL, atol=0)
+                    for v in exact for k in ('mean', 'sd')
+                )
+                _, _, th = pot_month(df, '95')
+                lower = np.quantile(df['swh'].values, 0.95, method='lower')
+                _, _, th_stream = stream_pot_month(f, '95', chunksize=CHUNK)
+                th_ratio = abs(th_stream - lower) / (ALPHA * lower)
+                ok = max(ratio, th_ratio) <= 1 + TOL and same and moments
+                failed |= not ok
+                print(f'{years:5d}  {os.path.splitext(f)[1]:7s}  {t1:8.3f} {p1 / 2**20:8.1f}      '
+                      f'{t2:8.3f} {p2 / 2**20:8.1f}     {ratio:10.3f}          {same!s:5s}  '
+                      f'{moments!s:7s}  {abs(th_stream - th) / th:.2%}'
+                      + ('' if ok else '  FAIL'))
+        csv_fname = os.path.join(tmp, 'appmar2-season.csv')
+        write_fixture(csv_fname, sizes[0], months=SEASON)
+        fname = os.path.join(tmp, 'appmar2-season.series')
+        write_series(csv_fname, fname)
+        for f in (csv_fname, fname):
+            ok = check_pot_month(f)
+            failed |= not ok
+            print(f'{os.path.splitext(f)[1]} pot_month of {len(SEASON)} months a year: '
+                  + ('same' if ok else 'FAIL'))
+    for ext, sizes in peaks.items():
+        (y1, p1), (y2, p2) = min(sizes), max(sizes)
+        ok = p2 <= FLAT_TOL * p1
+        failed |= not ok
+        print(f'{ext} streaming peak, {y2} years over {y1}: {p2 / p1:.2f}'
+              + ('' if ok else '  FAIL'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
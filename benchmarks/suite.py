@@ -0,0 +1,248 @@
+"""
+Benchmark suite of APPMAR 2 on synthetic data generated locally, without network (see
+fixtures.py): extraction from GRIB files with extractor and extract_series, loading of
+series as on_load does, compute_clusters, fit_and_test_all, the densities of the
+distribution plots, the rose binning and the peaks over threshold statistics, each at several data sizes.
+
+Times are the best of several runs. Results are saved as JSON, by default in
+benchmarks/results/<commit>.json, to be compared with those of other commits: --compare
+prints the ratio of each time to the one in a previous results file and exits with
+status 1 if any case got slower than the tolerance.
+
+    python benchmarks/suite.py [--quick] [-o FILE] [--compare FILE] [case ...]
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import product
+
+import numpy as np
+
+from appmar2.libappmar2 import (compute_clusters, extract_series, extractor, load_series,
+                                pot_month, rose_data, rose_histogram)
+from appmar2.libkde import kde_1d, kde_2d
+from appmar2.libmetrics import Metrics
+from appmar2.libseries import SeriesWriter
+from appmar2.libstats import fit_and_test_all
+from fixtures import write_archive, write_fixture
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+GRID = 'bench'
+PARAMS = ['hs', 'tp', 'dp']
+# sites extracted at once by extract_series
+SITES = 3
+REPEAT = 3
+# as in the main window
+FIT_TIMEOUT = 60
+# ratio to the previous time above which a case is reported as slower
+TOLERANCE = 1.2
+
+
+def archive(nmonths):
+    """Writes the GRIB files of nmonths months and returns their years, months and a
+    point of the grid."""
+    years = range(1979, 1979 + max(1, nmonths // 12))
+    months = range(1, min(nmonths, 12) + 1)
+    return years, months, write_archive(GRID, PARAMS, years, months)
+
+
+def series_csv(years):
+    fname = f'series-{years}.csv'
+    if not os.path.exists(fname):
+        write_fixture(fname, years)
+    return fname
+
+
+def bench_extractor(nmonths):
+    years, months, (lat, lon) = archive(nmonths)
+
+    def run():
+        f = extractor(GRID, lat, lon)
+        for year, month, param in product(years, months, PARAMS):
+            f(year, month, param).load()
+    return run
+
+
+def bench_extract_series(nmonths, workers=None):
+    years, months, (lat, lon) = archive(nmonths)
+    coords = [(lat + k, lon + k) for k in range(SITES)]
+
+    def run():
+        # extract from scratch, not just the missing blocks
+        for fname in glob.glob('appmar2-*'):
+            os.remove(fname)
+        metrics = Metrics('extract')
+        extract_series(GRID, coords, PARAMS, years, months, workers=workers, metrics=metrics)
+        return {stage: s['seconds'] for stage, s in metrics.summary()['stages'].items()}
+    return run
+
+
+def bench_extract_parallel(nmonths):
+    # two processes at least, so the pool is used even on a single CPU
+    return bench_extract_series(nmonths, max(2, os.cpu_count()))
+
+
+def bench_load_csv(years):
+    fname = series_csv(years)
+    return lambda: load_series(fname)
+
+
+def bench_load_binary(years):
+    fname = f'series-{years}.series'
+    if not os.path.exists(fname):
+        SeriesWriter(fname).append(load_series(series_csv(years)).set_index(['time', 'step']))
+    return lambda: load_series(fname)
+
+
+def bench_clusters(years):
+    df = load_series(series_csv(years))
+    pairs = np.column_stack((df['swh'].values, df['perpw'].values))
+    return lambda: compute_clusters(pairs)
+
+
+def bench_fits(n):
+    from scipy import stats
+    sample = stats.genextreme.rvs(-0.1, loc=3, scale=0.5, size=n, random_state=0)
+    return lambda: fit_and_test_all(sample, workers=os.cpu_count(), timeout=FIT_TIMEOUT)
+
+
+def bench_kde_1d(years):
+    df = load_series(series_csv(years))
+    return lambda: kde_1d(df['swh'].values)
+
+
+def bench_kde_2d(years):
+    df = load_series(series_csv(years))
+    return lambda: kde_2d(df['swh'].values, df['perpw'].values)
+
+
+def bench_rose(years):
+    df = load_series(series_csv(years))
+
+    def run():
+        for rosetype in ('hs', 'tp', 'wind'):
+            rose_histogram(*rose_data(df, rosetype))
+    return run
+
+
+def bench_peaks(years):
+    df = load_series(series_csv(years))
+    return lambda: pot_month(df, '95')
+
+
+# name: (unit, sizes, quick sizes, setup, runs)
+CASES = {
+    'extractor': ('months', [3, 12], [3], bench_extractor, REPEAT),
+    'extract_series': ('months', [3, 12, 24], [3], bench_extract_series, REPEAT),
+    'extract_parallel': ('months', [12, 24], [3], bench_extract_parallel, REPEAT),
+    'load_csv': ('years', [1, 10, 31], [1], bench_load_csv, REPEAT),
+    'load_binary': ('years', [1, 10, 31], [1], bench_load_binary, REPEAT),
+    'compute_clusters': ('years', [1, 10, 31], [1], bench_clusters, REPEAT),
+    'fit_and_test_all': ('samples', [30, 300, 3000], [30], bench_fits, 1),
+    'kde_1d': ('years', [1, 10, 31], [1], bench_kde_1d, REPEAT),
+    'kde_2d': ('years', [1, 10, 31], [1], bench_kde_2d, REPEAT),
+    'rose_histogram': ('years', [1, 10, 31], [1], bench_rose, REPEAT),
+    'pot_month': ('years', [1, 10, 31], [1], bench_peaks, REPEAT)
+}
+
+
+def measure(run, repeat):
+    """Times run() repeat times. run may return a dict of details of the run, e.g. the
+    time of its stages, kept for the best one."""
+    times = []
+    details = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        details.append(run())
+        times.append(time.perf_counter() - t)
+    best = int(np.argmin(times))
+    result = {'best': times[best], 'median': statistics.median(times), 'times': times}
+    if isinstance(details[best], dict):
+        result['details'] = details[best]
+    return result
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(previous, current):
+    """Prints the ratio of the current times to the previous ones and returns the number of
+    cases slower than the tolerance."""
+    print(f"\nAgainst {previous['commit']} ({previous['date']}):")
+    slower = 0
+    for name, sizes in current['results'].items():
+        for size, result in sizes.items():
+            old = previous['results'].get(name, {}).get(size)
+            if old is None:
+                continue
+            ratio = result['best'] / old['best']
+            flag = ratio > TOLERANCE
+            slower += flag
+            print(f"{name:18s} {size:>6s}  {old['best']:9.3f} -> {result['best']:9.3f} s  "
+                  f"{ratio:5.2f}x" + ('  SLOWER' if flag else ''))
+    return slower
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='APPMAR 2 benchmark suite')
+    parser.add_argument('cases', nargs='*', metavar='CASE',
+                        help='cases to run (default: all): ' + ', '.join(CASES))
+    parser.add_argument('--quick', action='store_true', help='smallest sizes only')
+    parser.add_argument('-o', '--output', type=os.path.abspath,
+                        help='results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', type=os.path.abspath, metavar='FILE',
+                        help='results file of a previous run')
+    args = parser.parse_args(argv)
+    unknown = [c for c in args.cases if c not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    commit = revision()
+    results = {}
+    print('case               size  unit        best (s)  median (s)')
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # fixtures, GRIB index cache and extracted series all go here
+        os.chdir(tmp)
+        try:
+            for name in args.cases or CASES:
+                unit, sizes, quick, setup, repeat = CASES[name]
+                for size in quick if args.quick else sizes:
+                    result = measure(setup(size), repeat)
+                    results.setdefault(name, {})[str(size)] = result
+                    print(f"{name:18s} {size:>6d}  {unit:8s}  {result['best']:9.3f}  "
+                          f"{result['median']:10.3f}", flush=True)
+        finally:
+            os.chdir(cwd)
+    current = {
+        'commit': commit, 'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'cpus': os.cpu_count(), 'quick': args.quick, 'results': results
+    }
+    output = args.output or os.path.join(RESULTS_DIR, commit + '.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f'Results saved to {output}')
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        return 1 if compare(previous, current) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))